@@ -29,6 +29,9 @@ class TimeBuffer(object):
     def append(self, time):
         self._times.append(time)
 
+    def extend(self, times):
+        self._times.extend(times)
+
 
 class WindowedTimeBuffer(TimeBuffer):
     def __init__(self, time_window):
@@ -55,6 +58,9 @@ class SpikeBuffer(TimeBuffer):
     def append_spike(self, time):
         self.append(time)
 
+    def extend_spikes(self, times):
+        self.extend(times)
+
 
 class WindowedSpikeBuffer(WindowedTimeBuffer, SpikeBuffer):
     def __init__(self, time_window):
@@ -4,6 +4,7 @@ import numpy as np
 import music
 
 from snn_utils import buffer
+from snn_utils.comm.packing import group_by_index
 
 logger = logging.getLogger(__name__)
 
@@ -11,16 +12,39 @@ logger = logging.getLogger(__name__)
 class PortUtility(object):
     """
     Helper class for publishing ports and collecting data on input ports.
+
+    Ports published with `partitioned=True` are split among the processes (ranks) of the node:
+    each rank maps a contiguous slice `partition(width)` of the port's index range.
+    Buffers then only cover this slice and event indices are relative to its base.
     """
 
     def __init__(self, music_setup=None, fail_on_unconnected=False, buffer=None):
-        self._music_setup = music_setup
         self._fail_on_unconnected = fail_on_unconnected
         self._published_port_names = []
         self._buffer = buffer
+        self._comm = None
+        self._set_music_setup(music_setup)
 
     def _set_music_setup(self, music_setup):
         self._music_setup = music_setup
+        if music_setup is not None:
+            # communicator of this application's processes
+            self._comm = getattr(music_setup, 'comm', None)
+
+    def _rank(self):
+        return self._comm.Get_rank() if self._comm is not None else 0
+
+    def _n_ranks(self):
+        return self._comm.Get_size() if self._comm is not None else 1
+
+    def partition(self, width, rank=None):
+        """
+        Returns `(base, size)` of the contiguous slice of `width` indices handled by the given (or this) rank.
+        """
+        rank = self._rank() if rank is None else rank
+        n_ranks = self._n_ranks()
+        base = rank * width // n_ranks
+        return base, (rank + 1) * width // n_ranks - base
 
     def _set_buffer(self, buffer_factory):
         self._buffer = buffer_factory
@@ -29,8 +53,9 @@ class PortUtility(object):
         return self._buffer
 
     @staticmethod
-    def _init_buffer(proxy, initial_value=None, fallback_width=0):
-        width = proxy.width() if proxy.isConnected() else fallback_width
+    def _init_buffer(proxy, initial_value=None, fallback_width=0, width=None):
+        if width is None:
+            width = proxy.width() if proxy.isConnected() else fallback_width
         assert width is not None
         if initial_value is not None:
             assert len(initial_value) == width
@@ -53,22 +78,33 @@ class PortUtility(object):
             if param_name not in kwargs:
                 raise music.MUSICError("Missing parameter {} for port {}".format(param_name, port_name))
 
-    def publish_cont_output(self, port_name, initial_value=None, fallback_width=0, **kwargs):
+    def _partition_port(self, proxy, partitioned, fallback_width, kwargs):
+        # returns the local width, updates the mapping parameters with the base of this rank's slice
+        if not partitioned:
+            return None
+        width = proxy.width() if proxy.isConnected() else fallback_width
+        base, size = self.partition(width)
+        kwargs['base'] = base
+        return size
+
+    def publish_cont_output(self, port_name, initial_value=None, fallback_width=0, partitioned=False, **kwargs):
         assert self._music_setup is not None
         self._port_name_check(port_name)
         proxy = self._music_setup.publishContOutput(port_name)
-        buf, width = PortUtility._init_buffer(proxy, initial_value, fallback_width)
+        local_width = self._partition_port(proxy, partitioned, fallback_width, kwargs)
+        buf, width = PortUtility._init_buffer(proxy, initial_value, fallback_width, local_width)
         if proxy.isConnected():
             proxy.map(buf, **kwargs)
         else:
             self._handle_unconnected_port("Output port {} is not connected".format(port_name))
         return buf
 
-    def publish_cont_input(self, port_name, initial_value=None, fallback_width=0, **kwargs):
+    def publish_cont_input(self, port_name, initial_value=None, fallback_width=0, partitioned=False, **kwargs):
         assert self._music_setup is not None
         self._port_name_check(port_name)
         proxy = self._music_setup.publishContInput(port_name)
-        buf, width = PortUtility._init_buffer(proxy, initial_value, fallback_width)
+        local_width = self._partition_port(proxy, partitioned, fallback_width, kwargs)
+        buf, width = PortUtility._init_buffer(proxy, initial_value, fallback_width, local_width)
         if proxy.isConnected():
             proxy.map(buf, **kwargs)
         else:
@@ -76,8 +112,16 @@ class PortUtility(object):
         return buf
 
     def publish_buffering_cont_input(self, *args, **kwargs):
+        """
+        Publishes a continuous input port whose values are collected in one value buffer per index.
+
+        By default, values are recorded each tick. Passing `decimation` (every n-th tick) or `sampling_interval`
+        (once per interval [s]) records only one sample per period, reduced by `reduction` (see `ContSampler`).
+        """
+        sampling = {name: kwargs.pop(name) for name in ['decimation', 'sampling_interval', 'reduction']
+                    if name in kwargs}
         buf = self.publish_cont_input(*args, **kwargs)
-        return self._buffer.buffer_cont_input(buf)
+        return self._buffer.buffer_cont_input(buf, **sampling)
 
     def publish_event_input(self, port_name, spike_callback, **kwargs):
         assert self._music_setup is not None
@@ -90,31 +134,57 @@ class PortUtility(object):
 
     def publish_buffering_event_input(self, port_name, fallback_width=1,
                                       width_to_n_buffers=lambda size: size, idx_to_buffer=lambda idx: idx,
-                                      **kwargs):
+                                      batched=False, staging_capacity=1024, partitioned=False, **kwargs):
+        """
+        Publishes an event input port whose spikes are collected in one spike buffer per (mapped) index.
+        Indices passed to `idx_to_buffer` are relative to `base`, i.e. to the slice mapped by this rank.
+
+        If `batched` is set, the MUSIC callback only stages raw (time, index) pairs in preallocated arrays;
+        they are distributed into the buffers once per cycle by `BaseBuffer.pre_cycle`.
+        In this case, `idx_to_buffer` is applied to an array of indices and has to be vectorized.
+        """
         self._port_name_check(port_name)
         proxy = self._music_setup.publishEventInput(port_name)
+        local_width = self._partition_port(proxy, partitioned, fallback_width, kwargs)
         width = proxy.width() if proxy.isConnected() else fallback_width
+        if local_width is None and proxy.isConnected():
+            self._check_parameters(port_name, ['base'], kwargs)
+            local_width = kwargs.pop('size', width - kwargs['base'])
+        elif local_width is None:
+            local_width = width
         assert self._buffer is not None
-        spike_buffers = self._buffer.buffer_event_input(width_to_n_buffers(width))
+        spike_buffers = self._buffer.buffer_event_input(width_to_n_buffers(local_width))
         if proxy.isConnected():
-            self._check_parameters(port_name, ['base'], kwargs)
-            assert kwargs['base'] == 0, "base != 0 not implemented yet"  # TODO
-            proxy.map(lambda time, _, index: spike_buffers[idx_to_buffer(index)].append_spike(time),
-                      music.Index.GLOBAL, size=width, **kwargs)
+            base = kwargs['base']
+            if batched:
+                stager = EventStager(staging_capacity)
+                self._buffer.stage_event_input(spike_buffers, stager, lambda indices: idx_to_buffer(indices - base))
+                callback = stager.append
+            else:
+                def callback(time, _, index):
+                    spike_buffers[idx_to_buffer(index - base)].append_spike(time)
+            proxy.map(callback, music.Index.GLOBAL, size=local_width, **kwargs)
         else:
             self._handle_unconnected_port("Input port {} is not connected".format(port_name))
         return spike_buffers
 
-    def publish_event_output(self, port_name, **kwargs):
+    def publish_event_output(self, port_name, bulk=False, partitioned=False, **kwargs):
+        """
+        Publishes an event output port and returns its proxy (`DummyEventOutput` if unconnected).
+        If `bulk` is set, the proxy is wrapped in an `EventOutput` for inserting arrays of events,
+        whose indices are relative to `base` (i.e. to the slice mapped by this rank).
+        """
         self._port_name_check(port_name)
         proxy = self._music_setup.publishEventOutput(port_name)
+        local_width = self._partition_port(proxy, partitioned, 0, kwargs)
         if proxy.isConnected():
             self._check_parameters(port_name, ['base'], kwargs)
-            proxy.map(music.Index.GLOBAL, size=proxy.width(), **kwargs)
+            size = local_width if local_width is not None else kwargs.pop('size', proxy.width() - kwargs['base'])
+            proxy.map(music.Index.GLOBAL, size=size, **kwargs)
         else:
             self._handle_unconnected_port("Output port {} is not connected".format(port_name))
             proxy = DummyEventOutput()
-        return proxy
+        return EventOutput(proxy, kwargs.get('base', 0)) if bulk else proxy
 
 
 class DummyEventOutput(object):
@@ -122,10 +192,180 @@ class DummyEventOutput(object):
         pass
 
 
+class EventOutput(object):
+    """
+    Inserts arrays of events into an event output proxy and counts them.
+
+    `n_events` is the total number of emitted events, `n_calls` the number of bulk insertions and
+    `n_empty` the number of those which did not contain any event.
+    Indices of bulk insertions are relative to `base`.
+    """
+
+    def __init__(self, proxy, base=0):
+        self._proxy = proxy
+        self._base = base
+        self.n_events = 0
+        self.n_calls = 0
+        self.n_empty = 0
+
+    def insertEvent(self, time, index, mapping):
+        self.n_events += 1
+        self._proxy.insertEvent(time, index, mapping)
+
+    def insert_events(self, times, indices):
+        """
+        :param times: either one time for all events or an array of times of the same length as `indices`.
+        :param indices: array of indices relative to `base`.
+        """
+        self.n_calls += 1
+        n = len(indices)
+        if not n:
+            self.n_empty += 1
+            return
+        self.n_events += n
+        insert = self._proxy.insertEvent
+        global_index = music.Index.GLOBAL
+        indices = np.asarray(indices)
+        indices = (indices + self._base if self._base else indices).tolist()
+        if np.ndim(times) == 0:
+            time = float(times)
+            for index in indices:
+                insert(time, index, global_index)
+        else:
+            for time, index in zip(np.asarray(times, dtype=np.double).tolist(), indices):
+                insert(time, index, global_index)
+
+    def insert_spike_vector(self, time, spikes):
+        """
+        Emits one event at `time` for each index whose entry in the boolean vector `spikes` is set.
+        """
+        if not spikes.any():
+            self.n_calls += 1
+            self.n_empty += 1
+            return
+        self.insert_events(time, np.flatnonzero(spikes))
+
+
+class EventStager(object):
+    """
+    Collects the raw (time, index) pairs of incoming events in preallocated arrays.
+    `append` serves as MUSIC event callback; the arrays grow if more events arrive between two `flush` calls.
+    """
+
+    def __init__(self, capacity=1024):
+        self._times = np.empty(capacity, dtype=np.double)
+        self._indices = np.empty(capacity, dtype=np.int64)
+        self._n = 0
+
+    def append(self, time, _, index):
+        n = self._n
+        if n == len(self._times):
+            self._times = np.resize(self._times, 2 * n)
+            self._indices = np.resize(self._indices, 2 * n)
+        self._times[n] = time
+        self._indices[n] = index
+        self._n = n + 1
+
+    def __len__(self):
+        return self._n
+
+    def flush(self):
+        """
+        Returns views onto the staged times and indices, which are valid until the next call of `append`.
+        """
+        n = self._n
+        self._n = 0
+        return self._times[:n], self._indices[:n]
+
+
+class ContSampler(object):
+    """
+    Reduces the values of a continuous input to one sample per period of `decimation` ticks or, if given,
+    per `sampling_interval` [s] (aligned to multiples of the interval).
+
+    `reduction` is one of 'last', 'mean', 'min', 'max' (sampled at the end of the period) or 'minmax',
+    which yields both extrema of each channel at the times at which they occurred.
+    """
+
+    REDUCTIONS = ['last', 'mean', 'min', 'max', 'minmax']
+
+    def __init__(self, width, decimation=1, sampling_interval=None, reduction='last'):
+        assert reduction in ContSampler.REDUCTIONS, "Unknown reduction: {}".format(reduction)
+        assert decimation >= 1
+        self._decimation = decimation
+        self._sampling_interval = sampling_interval
+        self._reduction = reduction
+        self._n_ticks = 0
+        self._last_period = None
+        self._sum = np.zeros(width, dtype=np.double)
+        self._min = np.full(width, np.inf)
+        self._max = np.full(width, -np.inf)
+        self._min_time = np.zeros(width, dtype=np.double)
+        self._max_time = np.zeros(width, dtype=np.double)
+
+    def _accumulate(self, curr_sim_time, values):
+        reduction = self._reduction
+        if reduction == 'mean':
+            self._sum += values
+        if reduction in ('min', 'minmax'):
+            smaller = values < self._min
+            self._min[smaller] = values[smaller]
+            self._min_time[smaller] = curr_sim_time
+        if reduction in ('max', 'minmax'):
+            larger = values > self._max
+            self._max[larger] = values[larger]
+            self._max_time[larger] = curr_sim_time
+
+    def _period_ends(self, curr_sim_time):
+        if self._sampling_interval is None:
+            return self._n_ticks >= self._decimation
+        period = int(np.floor(curr_sim_time / self._sampling_interval + 1e-9))
+        if self._last_period is None:
+            # the first tick starts a period rather than ending one
+            self._last_period = period
+            return False
+        if period == self._last_period:
+            return False
+        self._last_period = period
+        return True
+
+    def _reduce(self, curr_sim_time, values):
+        reduction = self._reduction
+        if reduction == 'last':
+            samples = [(curr_sim_time, values.copy())]
+        elif reduction == 'mean':
+            samples = [(curr_sim_time, self._sum / self._n_ticks)]
+        elif reduction == 'min':
+            samples = [(curr_sim_time, self._min.copy())]
+        elif reduction == 'max':
+            samples = [(curr_sim_time, self._max.copy())]
+        else:
+            # both extrema per channel, in order of occurrence
+            min_first = self._min_time <= self._max_time
+            samples = [(np.where(min_first, self._min_time, self._max_time), np.where(min_first, self._min, self._max)),
+                       (np.where(min_first, self._max_time, self._min_time), np.where(min_first, self._max, self._min))]
+        self._n_ticks = 0
+        self._sum.fill(0.0)
+        self._min.fill(np.inf)
+        self._max.fill(-np.inf)
+        return samples
+
+    def sample(self, curr_sim_time, values):
+        """
+        Accumulates the values of a tick and returns a list of (time(s), values) samples, empty within a period.
+        """
+        self._n_ticks += 1
+        self._accumulate(curr_sim_time, values)
+        if not self._period_ends(curr_sim_time):
+            return []
+        return self._reduce(curr_sim_time, values)
+
+
 class BaseBuffer(object):
     def __init__(self):
         self._cont_array_buffers = []
         self._all_buffers = []
+        self._staged_event_inputs = []
 
     def _create_value_buffer(self):
         return buffer.ValueBuffer()
@@ -133,9 +373,11 @@ class BaseBuffer(object):
     def _create_event_buffer(self):
         return buffer.SpikeBuffer()
 
-    def buffer_cont_input(self, array_buffer):
+    def buffer_cont_input(self, array_buffer, decimation=1, sampling_interval=None, reduction='last'):
         buffers = [self._create_value_buffer() for _ in range(len(array_buffer))]
-        self._cont_array_buffers.append((buffers, array_buffer))
+        sampler = ContSampler(len(array_buffer), decimation, sampling_interval, reduction) \
+            if decimation != 1 or sampling_interval is not None else None
+        self._cont_array_buffers.append((buffers, array_buffer, sampler))
         self._all_buffers.extend(buffers)
         return buffers
 
@@ -144,10 +386,28 @@ class BaseBuffer(object):
         self._all_buffers.extend(buffers)
         return buffers
 
+    def stage_event_input(self, buffers, stager, idx_to_buffer):
+        self._staged_event_inputs.append((buffers, stager, idx_to_buffer))
+
+    def _distribute_staged_events(self):
+        for buffers, stager, idx_to_buffer in self._staged_event_inputs:
+            if not len(stager):
+                continue
+            times, indices = stager.flush()
+            for buffer_index, buffer_times in group_by_index(idx_to_buffer(indices), times):
+                buffers[buffer_index].extend_spikes(buffer_times.tolist())
+
     def pre_cycle(self, curr_sim_time):
-        for buffers, array_buffer in self._cont_array_buffers:
-            for i, buffer in enumerate(buffers):
-                buffer.append_value(curr_sim_time, array_buffer[i])
+        for buffers, array_buffer, sampler in self._cont_array_buffers:
+            if sampler is None:
+                for i, buffer in enumerate(buffers):
+                    buffer.append_value(curr_sim_time, array_buffer[i])
+                continue
+            for sample_times, values in sampler.sample(curr_sim_time, array_buffer):
+                sample_times = np.broadcast_to(sample_times, values.shape).tolist()
+                for buffer, sample_time, value in zip(buffers, sample_times, values.tolist()):
+                    buffer.append_value(sample_time, value)
+        self._distribute_staged_events()
 
     def post_cycle(self, curr_sim_time):
         pass
@@ -3,9 +3,13 @@ import logging
 import time
 
 import music
+import numpy as np
 from mpi4py import MPI
 
 from snn_utils.comm.music import PortUtility
+from snn_utils.comm.music.node.profiler import CycleProfiler, NullCycleProfiler
+from snn_utils.comm.music.node.realtime import RealTimeTracker
+from snn_utils.comm.worker import BackgroundWorker
 
 logger = logging.getLogger(__name__)
 
@@ -22,11 +26,46 @@ class Node(object):
 
 
 class PyMusicNode(Node, PortUtility):
-    def __init__(self, time_step, total_time=None, pre_run_barrier=False, measure_cycle_time=True):
+    """
+    Base class for python MUSIC nodes.
+
+    With `profile`, each cycle is broken down into the time spent waiting for the MUSIC runtime ('wait'),
+    the buffers ('buffer_pre', 'buffer_post') and the node's own hooks ('pre_cycle', 'cycle', 'post_cycle')
+    (see `CycleProfiler`). A summary is logged after the run and available on demand via `profile_summary`.
+
+    If the node runs on several processes, ports published with `partitioned=True` are split among them
+    (see `PortUtility.partition`). Each rank then processes its share in `_run_single_cycle`; results can be
+    collected on one rank with `_gather_partitioned` and `_reduce`, e.g. for publishing them from rank 0.
+
+    With `side_tasks`, work that does not affect the simulation (e.g. serializing and publishing data via ZMQ)
+    can be moved off the critical path between two MUSIC ticks with `_submit_side_task`: such tasks are executed
+    in order on a background thread. At most `side_task_queue` tasks are pending; further submissions block or,
+    with `drop_side_tasks`, are dropped. The queue depth is reported by `side_task_metrics`.
+    Pending side tasks are completed before `_post_run`. They run concurrently with subsequent cycles, in which
+    buffers are updated or cleared (e.g. by `SingleStepBuffer.post_cycle`): side tasks must not access live buffers,
+    but only data copied on the main thread, e.g. `ProxyDataSource.dump_delta(curr_time, copy=True)`.
+
+    With `track_real_time`, simulation time is compared to wall-clock time each cycle (see `RealTimeTracker`):
+    `real_time_factor` and `real_time_slack` are available during the run and a warning is logged whenever the node
+    falls behind real time by more than `real_time_tolerance` [s] (default: one time step).
+    With `pace`, the node sleeps while it is ahead, i.e. runs at most at wall-clock speed.
+    """
+
+    PROFILE_PHASES = ['wait', 'buffer_pre', 'pre_cycle', 'cycle', 'post_cycle', 'buffer_post']
+
+    def __init__(self, time_step, total_time=None, pre_run_barrier=False, measure_cycle_time=True, profile=False,
+                 profile_capacity=1024, side_tasks=False, side_task_queue=16, drop_side_tasks=False,
+                 track_real_time=False, pace=False, rtf_window=100, real_time_tolerance=None):
         Node.__init__(self, total_time, pre_run_barrier)
         PortUtility.__init__(self)
         self._time_step = time_step
         self._measure_cycle_time = measure_cycle_time
+        self._profiler = CycleProfiler(PyMusicNode.PROFILE_PHASES, profile_capacity) if profile else None
+        self._side_task_worker = BackgroundWorker(side_task_queue, "side-tasks", drop_side_tasks) \
+            if side_tasks else None
+        self._real_time = RealTimeTracker(rtf_window, pace,
+                                          real_time_tolerance if real_time_tolerance is not None else time_step,
+                                          name=type(self).__name__) if track_real_time or pace else None
 
     @staticmethod
     def __runtime(music_setup, timestep, total_time):
@@ -44,16 +83,87 @@ class PyMusicNode(Node, PortUtility):
         pass
 
     def _run(self, times):
+        profiler = self._profiler if self._profiler is not None else NullCycleProfiler()
+        wait, buffer_pre, pre_cycle, cycle, post_cycle, buffer_post = range(len(PyMusicNode.PROFILE_PHASES))
+        if self._real_time is not None:
+            self._real_time.start()
+        profiler.start()
         for curr_time in times:
+            if self._real_time is not None:
+                # pacing is accounted as waiting
+                self._real_time.update(curr_time)
+            profiler.lap(wait)
             if self._get_buffer() is not None:
                 self._get_buffer().pre_cycle(curr_time)
+            profiler.lap(buffer_pre)
             self._pre_cycle(curr_time)
+            profiler.lap(pre_cycle)
             before_time = time.time() if self._measure_cycle_time else None
             self._run_single_cycle(curr_time)
+            profiler.lap(cycle)
             if before_time is not None:
                 self._post_cycle(curr_time, time.time() - before_time)
+            profiler.lap(post_cycle)
             if self._get_buffer() is not None:
                 self._get_buffer().post_cycle(curr_time)
+            profiler.lap(buffer_post)
+            profiler.end_cycle()
+
+    def profile_summary(self):
+        return self._profiler.summary() if self._profiler is not None else None
+
+    def _is_root(self, root=0):
+        return self._rank() == root
+
+    def _gather_partitioned(self, local_array, width, root=0):
+        """
+        Gathers the slices `partition(width)` of all ranks into one array of `width` entries on rank `root`.
+        Returns None on all other ranks.
+        """
+        if self._comm is None:
+            return local_array
+        full_array = np.empty(width, dtype=local_array.dtype) if self._is_root(root) else None
+        bases, sizes = zip(*[self.partition(width, rank) for rank in range(self._n_ranks())])
+        self._comm.Gatherv(np.ascontiguousarray(local_array), [full_array, (sizes, bases)], root=root)
+        return full_array
+
+    def _reduce(self, local_array, op=MPI.SUM, root=0):
+        """
+        Element-wise reduction of equally shaped arrays of all ranks on rank `root`. Returns None on all other ranks.
+        """
+        if self._comm is None:
+            return local_array
+        local_array = np.ascontiguousarray(local_array)
+        result = np.empty_like(local_array) if self._is_root(root) else None
+        self._comm.Reduce(local_array, result, op=op, root=root)
+        return result
+
+    def real_time_factor(self):
+        return self._real_time.real_time_factor() if self._real_time is not None else None
+
+    def real_time_slack(self):
+        return self._real_time.slack() if self._real_time is not None else None
+
+    def _submit_side_task(self, fn, *args):
+        """
+        Executes `fn(*args)` in the background if side tasks are enabled, otherwise immediately.
+        The arguments have to be snapshots, not live buffers (see class documentation).
+        Returns False if the task has been dropped.
+        """
+        if self._side_task_worker is None:
+            fn(*args)
+            return True
+        return self._side_task_worker.submit(fn, *args)
+
+    def side_task_metrics(self):
+        return self._side_task_worker.metrics() if self._side_task_worker is not None else None
+
+    def _close_side_tasks(self):
+        if self._side_task_worker is not None:
+            self._side_task_worker.close()
+            metrics = self._side_task_worker.metrics()
+            logger.info("Side tasks: {submitted} executed, {dropped} dropped, max. queue depth {max_depth}."
+                        .format(**metrics))
 
     def _pre_run(self, music_setup):
         pass
@@ -79,4 +189,9 @@ class PyMusicNode(Node, PortUtility):
         times = PyMusicNode.__runtime(self._music_setup, self._time_step, self._total_time)
         self._set_music_setup(None)
         self._run(times)
+        if self._profiler is not None:
+            logger.info(self._profiler.format_summary())
+        if self._real_time is not None:
+            logger.info(self._real_time.format_summary())
+        self._close_side_tasks()
         self._post_run()
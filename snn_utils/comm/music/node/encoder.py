@@ -0,0 +1,123 @@
+import logging
+
+import numpy as np
+
+from snn_utils.comm.music.node import PyMusicNode
+
+logger = logging.getLogger(__name__)
+
+
+class RateEncoderNode(PyMusicNode):
+    """
+    Encodes the values of a continuous input port as rates [Hz] of spike trains on an event output port of the
+    same width (one channel per index).
+
+    Rates are `rate_scale * value + rate_offset`, clipped to `[0, max_rate]` and to `1 / refractory_period`.
+    Each tick, spikes of all channels are drawn at once within `[t, t + time_step)` and emitted via
+    `EventOutput.insert_events`. With `partitioned`, each rank encodes its slice of the channels.
+
+    With `mode='poisson'`, inter-spike intervals are `refractory_period` [s] plus an exponential interval of rate
+    `r / (1 - r * refractory_period)`, which keeps the mean rate at `r` despite the dead time. Rates may change
+    each tick (time rescaling of a unit exponential per channel).
+    With `mode='regular'`, channels spike at most once per tick with intervals `1 / r`; spikes closer than
+    `refractory_period` to the previous one (only possible after a rate increase) are dropped.
+    """
+
+    MODES = ['poisson', 'regular']
+
+    def __init__(self, time_step, in_port_name, out_port_name, mode='poisson', rate_scale=1.0, rate_offset=0.0,
+                 max_rate=None, refractory_period=0.0, seed=None, fallback_width=0, partitioned=False, **kwargs):
+        PyMusicNode.__init__(self, time_step, **kwargs)
+        assert mode in RateEncoderNode.MODES, "Unknown mode: {}".format(mode)
+        self._in_port_name = in_port_name
+        self._out_port_name = out_port_name
+        self._mode = mode
+        self._rate_scale = rate_scale
+        self._rate_offset = rate_offset
+        # at most one spike per refractory period (and per tick)
+        max_rates = [r for r in [max_rate, 1.0 / refractory_period if refractory_period > 0 else None]
+                     if r is not None]
+        self._max_rate = min(max_rates) if max_rates else np.inf
+        self._refractory_period = refractory_period
+        self._seed = seed
+        self._fallback_width = fallback_width
+        self._partitioned = partitioned
+        self._rng = None
+        self._values = None
+        self._output = None
+        self._rates = None
+        self._last_spike_times = None
+        self._phases = None
+        self._budgets = None
+
+    def _setup(self, music_setup):
+        self._values = self.publish_cont_input(self._in_port_name, fallback_width=self._fallback_width,
+                                               partitioned=self._partitioned)
+        self._output = self.publish_event_output(self._out_port_name, bulk=True, base=0,
+                                                 partitioned=self._partitioned)
+        n = len(self._values)
+        seed = self._seed + self._rank() if self._seed is not None else None
+        # standard_exponential is available on both, Generator and the RandomState fallback
+        self._rng = np.random.default_rng(seed) if hasattr(np.random, 'default_rng') \
+            else np.random.RandomState(seed)
+        self._rates = np.zeros(n, dtype=np.double)
+        self._last_spike_times = np.full(n, -np.inf)
+        self._phases = np.zeros(n, dtype=np.double)
+        self._budgets = self._rng.standard_exponential(n)
+        logger.info("Encoding {} channels of port {} as {} spike trains on port {}."
+                    .format(n, self._in_port_name, self._mode, self._out_port_name))
+
+    def _update_rates(self):
+        np.multiply(self._values, self._rate_scale, out=self._rates)
+        self._rates += self._rate_offset
+        np.clip(self._rates, 0.0, self._max_rate, out=self._rates)
+
+    def _draw_poisson(self, curr_time):
+        # a channel spikes once its rate, integrated over the time outside of refractoriness, exceeds its budget
+        refractory_period = self._refractory_period
+        rates = self._rates / np.maximum(1.0 - self._rates * refractory_period, 1e-12)
+        end = curr_time + self._time_step
+        starts = np.maximum(self._last_spike_times + refractory_period, curr_time)
+        channels = np.flatnonzero(starts < end)
+        starts = starts[channels]
+        all_times, all_channels = [], []
+        while len(channels):
+            hazards = rates[channels] * (end - starts)
+            budgets = self._budgets[channels]
+            fire = budgets < hazards
+            self._budgets[channels[~fire]] -= hazards[~fire]
+            channels, starts, budgets = channels[fire], starts[fire], budgets[fire]
+            times = starts + budgets / rates[channels]
+            self._budgets[channels] = self._rng.standard_exponential(len(channels))
+            self._last_spike_times[channels] = times
+            all_times.append(times)
+            all_channels.append(channels)
+            # further spikes within this tick
+            starts = times + refractory_period
+            remaining = starts < end
+            channels, starts = channels[remaining], starts[remaining]
+        if not all_times:
+            return np.empty(0), np.empty(0, dtype=int)
+        return np.concatenate(all_times), np.concatenate(all_channels)
+
+    def _draw_regular(self, curr_time):
+        phases_before = self._phases.copy()
+        self._phases += self._rates * self._time_step
+        channels = np.flatnonzero(self._phases >= 1.0)
+        rates = self._rates[channels]
+        times = curr_time + (1.0 - phases_before[channels]) / rates
+        # at most one spike per tick
+        self._phases[channels] = np.minimum(self._phases[channels] - 1.0, 1.0 - 1e-12)
+        return np.minimum(times, curr_time + self._time_step * (1.0 - 1e-12)), channels
+
+    def _run_single_cycle(self, curr_time):
+        self._update_rates()
+        if self._mode == 'poisson':
+            self._output.insert_events(*self._draw_poisson(curr_time))
+            return
+        times, channels = self._draw_regular(curr_time)
+        if self._refractory_period > 0 and len(channels):
+            admitted = times - self._last_spike_times[channels] >= self._refractory_period - 1e-12
+            times, channels = times[admitted], channels[admitted]
+            self._last_spike_times[channels] = times
+        self._output.insert_events(times, channels)
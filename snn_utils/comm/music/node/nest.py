@@ -1,6 +1,9 @@
 
 
 import logging
+import time
+
+import numpy as np
 
 import nest
 
@@ -10,8 +13,44 @@ logger = logging.getLogger(__name__)
 
 
 class PyNestNode(Node):
-    def __init__(self, total_time=None, pre_run_barrier=False):
+    """
+    Base class for NEST nodes of a MUSIC network.
+
+    With `bulk_proxies` (default), MUSIC channels of proxies are assigned with a single vectorized `SetStatus`
+    and output proxies are connected with a single `Connect` call using an array-valued `music_channel`.
+    If the NEST version rejects the latter, it falls back to one `Connect` call per neuron.
+
+    Unless `_run` is overridden, `total_time` [ms, as NEST] is simulated in chunks of `chunk_size` [ms]
+    (all at once if not set), both rounded (`total_time` down) to multiples of the resolution.
+    Hooks registered via `add_pre_chunk_hook`/`add_post_chunk_hook` are called with the current simulation time
+    before/after each chunk, e.g. `WeightCommunicator.communicate`.
+    If `target_rtf` (simulated time / wall-clock time) is given, the chunk size is adapted between
+    `min_chunk_size` (default: `chunk_size`) and `max_chunk_size` (default: `MAX_CHUNK_FACTOR * chunk_size`):
+    it grows while the node is slower than the target, which amortizes the per-chunk overhead, and shrinks again
+    while it is considerably faster, which lowers communication latency. The upper bound keeps the hooks running
+    at least every `max_chunk_size`; adaptation requires an initial `chunk_size`.
+    """
+
+    MAX_CHUNK_FACTOR = 8
+
+    def __init__(self, total_time=None, pre_run_barrier=False, bulk_proxies=True, chunk_size=None, target_rtf=None,
+                 min_chunk_size=None, max_chunk_size=None):
         Node.__init__(self, total_time, pre_run_barrier)
+        assert target_rtf is None or chunk_size is not None, "Adapting the chunk size requires an initial chunk_size"
+        self._bulk_proxies = bulk_proxies
+        self._chunk_size = chunk_size
+        self._target_rtf = target_rtf
+        self._min_chunk_size = min_chunk_size if min_chunk_size is not None else chunk_size
+        if max_chunk_size is None and chunk_size is not None:
+            max_chunk_size = PyNestNode.MAX_CHUNK_FACTOR * chunk_size
+        self._max_chunk_size = max_chunk_size
+        self._pre_chunk_hooks = []
+        self._post_chunk_hooks = []
+
+    @staticmethod
+    def _log_setup_phase(phase, port_name, size, ts_before):
+        logger.info("{} for port {} ({} channels) took {:f}s [real-time]."
+                    .format(phase, port_name, size, time.time() - ts_before))
 
     def _map_event_in_proxy(self, proxy_population, port_name, maxBuffered=None, accLatency=None):
         nest.SetStatus(proxy_population, {'port_name': port_name})
@@ -24,27 +63,95 @@ class PyNestNode(Node):
                     "as this NEST version does not support SetMaxBuffered".format(port_name))
         if accLatency is not None:
             nest.SetAcceptableLatency(port_name, float(accLatency))
-        for i, n in enumerate(proxy_population):
-            nest.SetStatus([n], 'music_channel', i)
+        ts_before = time.time()
+        if self._bulk_proxies:
+            nest.SetStatus(proxy_population, 'music_channel', list(range(len(proxy_population))))
+        else:
+            for i, n in enumerate(proxy_population):
+                nest.SetStatus([n], 'music_channel', i)
+        PyNestNode._log_setup_phase("Mapping input proxies", port_name, len(proxy_population), ts_before)
 
     def _create_event_in_proxy(self, size, port_name, maxBuffered=None, accLatency=None):
+        ts_before = time.time()
         proxy_population = nest.Create('music_event_in_proxy', size)
+        PyNestNode._log_setup_phase("Creating input proxies", port_name, size, ts_before)
         self._map_event_in_proxy(proxy_population, port_name, maxBuffered, accLatency)
         return proxy_population
 
     def _create_event_out_proxy(self, source_population, port_name):
         proxy_population = nest.Create('music_event_out_proxy')
         nest.SetStatus(proxy_population, {'port_name': port_name})
-        for i, n in enumerate(source_population):
-            nest.Connect([n], proxy_population, 'one_to_one', {'music_channel': i})
+        ts_before = time.time()
+        connected = False
+        if self._bulk_proxies:
+            try:
+                # all_to_all onto the single proxy: one row of channels per target
+                nest.Connect(source_population, proxy_population, 'all_to_all',
+                             {'music_channel': np.arange(len(source_population)).reshape(1, -1)})
+                connected = True
+            except nest.NESTError:
+                logger.warning("Bulk connection of output proxy {} failed, connecting neurons one by one."
+                               .format(port_name))
+        if not connected:
+            for i, n in enumerate(source_population):
+                nest.Connect([n], proxy_population, 'one_to_one', {'music_channel': i})
+        PyNestNode._log_setup_phase("Connecting output proxy", port_name, len(source_population), ts_before)
         return proxy_population
 
+    def add_pre_chunk_hook(self, hook):
+        self._pre_chunk_hooks.append(hook)
+
+    def add_post_chunk_hook(self, hook):
+        self._post_chunk_hooks.append(hook)
+
     def _setup(self):
         pass
 
-    def _run(self):
+    def _pre_chunk(self, sim_time):
+        pass
+
+    def _post_chunk(self, sim_time, measured_chunk_time):
         pass
 
+    def _adapt_chunk_size(self, chunk_size, simulated_time, measured_cycle_time, resolution):
+        rtf = simulated_time / 1000.0 / max(measured_cycle_time, 1e-9)
+        if rtf < self._target_rtf:
+            chunk_size *= 2
+        elif rtf > 1.5 * self._target_rtf:
+            chunk_size /= 2
+        return min(max(chunk_size, self._min_chunk_size or resolution), self._max_chunk_size)
+
+    def _run(self):
+        if self._total_time is None:
+            logger.warning("No total time given; override _run to simulate.")
+            return
+        resolution = nest.GetKernelStatus('resolution')
+        sim_time = nest.GetKernelStatus('time')
+        end_time = sim_time + self._total_time
+        chunk_size = self._chunk_size if self._chunk_size is not None else self._total_time
+        # chunks have to be multiples of the resolution
+        remaining_steps = int(np.floor((end_time - sim_time) / resolution + 1e-9))
+        if abs(remaining_steps * resolution - self._total_time) > 1e-9 * max(self._total_time, 1.0):
+            logger.warning("Total time {}ms is not a multiple of the resolution {}ms, simulating {}ms."
+                           .format(self._total_time, resolution, remaining_steps * resolution))
+        while remaining_steps > 0:
+            chunk_steps = min(max(int(round(chunk_size / resolution)), 1), remaining_steps)
+            chunk = chunk_steps * resolution
+            remaining_steps -= chunk_steps
+            before_time = time.time()
+            self._pre_chunk(sim_time)
+            for hook in self._pre_chunk_hooks:
+                hook(sim_time)
+            before_simulate = time.time()
+            nest.Simulate(chunk)
+            measured_chunk_time = time.time() - before_simulate
+            sim_time = nest.GetKernelStatus('time')
+            for hook in self._post_chunk_hooks:
+                hook(sim_time)
+            self._post_chunk(sim_time, measured_chunk_time)
+            if self._target_rtf is not None:
+                chunk_size = self._adapt_chunk_size(chunk_size, chunk, time.time() - before_time, resolution)
+
     def main(self):
         self._setup()
         self._execute_pre_run_barrier()
@@ -0,0 +1,121 @@
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    _clock_ns = time.perf_counter_ns
+except AttributeError:
+    def _clock_ns():
+        return int(time.perf_counter() * 1e9)
+
+
+class CycleProfiler(object):
+    """
+    Low-overhead timing of the phases of simulation cycles.
+
+    Each cycle, `lap(phase)` stores the time since the previous lap for the given phase index in a preallocated
+    array of `capacity` cycles. Whenever that array is full, it is folded into per-phase log-scale histograms
+    (20 bins per decade from 100ns to 100s), from which percentiles are estimated.
+    """
+
+    BIN_EDGES = np.logspace(2, 11, 9 * 20 + 1)
+
+    def __init__(self, phases, capacity=1024):
+        self.phases = list(phases)
+        self._capacity = capacity
+        self._durations = np.zeros((capacity, len(self.phases)), dtype=np.int64)
+        self._histograms = np.zeros((len(self.phases), len(CycleProfiler.BIN_EDGES) + 1), dtype=np.int64)
+        self._sums = np.zeros(len(self.phases), dtype=np.int64)
+        self._maxima = np.zeros(len(self.phases), dtype=np.int64)
+        self._index = 0
+        self._n_cycles = 0
+        self._row = self._durations[0]
+        self._last = None
+
+    def start(self):
+        self._last = _clock_ns()
+
+    def lap(self, phase):
+        now = _clock_ns()
+        self._row[phase] = now - self._last
+        self._last = now
+
+    def end_cycle(self):
+        self._index += 1
+        self._n_cycles += 1
+        if self._index == self._capacity:
+            self._fold()
+        self._row = self._durations[self._index]
+
+    def _fold(self):
+        block = self._durations[:self._index]
+        n_bins = self._histograms.shape[1]
+        for phase in range(len(self.phases)):
+            self._histograms[phase] += np.bincount(np.searchsorted(CycleProfiler.BIN_EDGES, block[:, phase]),
+                                                   minlength=n_bins)
+        self._sums += block.sum(axis=0)
+        self._maxima = np.maximum(self._maxima, block.max(axis=0))
+        self._index = 0
+
+    def _percentile(self, phase, q):
+        cumulative = np.cumsum(self._histograms[phase])
+        bin_index = int(np.searchsorted(cumulative, q * cumulative[-1]))
+        # upper edge of the bin, i.e. a conservative estimate
+        return CycleProfiler.BIN_EDGES[min(bin_index, len(CycleProfiler.BIN_EDGES) - 1)]
+
+    def summary(self):
+        """
+            Returns per-phase statistics [s]: mean, estimated percentiles (p50, p90, p99), max and total.
+        """
+        if self._index:
+            # keep the laps of a cycle in progress
+            in_progress = self._row.copy()
+            self._fold()
+            self._durations[0] = in_progress
+            self._row = self._durations[0]
+        result = {}
+        for phase, name in enumerate(self.phases):
+            if not self._n_cycles:
+                continue
+            result[name] = {
+                'mean': self._sums[phase] / self._n_cycles * 1e-9,
+                'p50': self._percentile(phase, 0.5) * 1e-9,
+                'p90': self._percentile(phase, 0.9) * 1e-9,
+                'p99': self._percentile(phase, 0.99) * 1e-9,
+                'max': self._maxima[phase] * 1e-9,
+                'total': self._sums[phase] * 1e-9,
+            }
+        return result
+
+    def n_cycles(self):
+        return self._n_cycles
+
+    def format_summary(self):
+        summary = self.summary()
+        total = sum(stats['total'] for stats in summary.values()) or 1.0
+        lines = ["Cycle profile ({} cycles):".format(self._n_cycles)]
+        for name in self.phases:
+            if name in summary:
+                stats = summary[name]
+                lines.append("  {:<12} {:6.1f}% mean {:9.3f}ms p50 {:9.3f}ms p90 {:9.3f}ms p99 {:9.3f}ms max {:9.3f}ms"
+                             .format(name, 100.0 * stats['total'] / total,
+                                     *[stats[k] * 1000.0 for k in ['mean', 'p50', 'p90', 'p99', 'max']]))
+        return "\n".join(lines)
+
+
+class NullCycleProfiler(object):
+    """
+    Stand-in for `CycleProfiler` if profiling is disabled: laps are not recorded.
+    """
+
+    def start(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def end_cycle(self):
+        pass
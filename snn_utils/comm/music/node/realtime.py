@@ -0,0 +1,73 @@
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RealTimeTracker(object):
+    """
+    Tracks simulation time versus wall-clock time [s] of the cycles of a node.
+
+    `real_time_factor` is simulated time / wall-clock time over the last `window` cycles (> 1 is faster than real
+    time), `slack` is how far [s] the simulation is ahead of (> 0) or behind (< 0) wall-clock time since `start`.
+    With `pace`, `update` sleeps while the simulation is ahead, which keeps it at wall-clock speed.
+    If the simulation falls behind by more than `tolerance`, a warning is logged at most every `warn_interval`.
+    """
+
+    def __init__(self, window=100, pace=False, tolerance=0.0, warn_interval=10.0, name=None):
+        self._window = collections.deque(maxlen=window + 1)
+        self._pace = pace
+        self._tolerance = tolerance
+        self._warn_interval = warn_interval
+        self._name = name
+        self._start_wall_time = None
+        self._start_sim_time = None
+        self._last_warning = None
+        self._slack = 0.0
+        self.min_slack = 0.0
+        self.sleep_time = 0.0
+
+    def start(self, sim_time=0.0):
+        self._start_wall_time = time.time()
+        self._start_sim_time = sim_time
+        self._window.clear()
+        self._window.append((self._start_wall_time, sim_time))
+
+    def update(self, sim_time):
+        now = time.time()
+        if self._start_wall_time is None:
+            self.start(sim_time)
+            return
+        slack = (sim_time - self._start_sim_time) - (now - self._start_wall_time)
+        if self._pace and slack > 0:
+            time.sleep(slack)
+            self.sleep_time += slack
+            now = time.time()
+            slack = (sim_time - self._start_sim_time) - (now - self._start_wall_time)
+        self._slack = slack
+        self.min_slack = min(self.min_slack, slack)
+        self._window.append((now, sim_time))
+        if slack < -self._tolerance and \
+                (self._last_warning is None or now - self._last_warning >= self._warn_interval):
+            self._last_warning = now
+            logger.warning("{}behind real time by {:.3f}s at t={:.3f}s (real-time factor {:.3f})."
+                           .format("{}: ".format(self._name) if self._name else "", -slack, sim_time,
+                                   self.real_time_factor()))
+
+    def real_time_factor(self):
+        if len(self._window) < 2:
+            return None
+        (first_wall_time, first_sim_time), (last_wall_time, last_sim_time) = self._window[0], self._window[-1]
+        return (last_sim_time - first_sim_time) / max(last_wall_time - first_wall_time, 1e-9)
+
+    def slack(self):
+        return self._slack
+
+    def format_summary(self):
+        if self._start_wall_time is None or len(self._window) < 2:
+            return "Real time: no cycles."
+        wall_time = self._window[-1][0] - self._start_wall_time
+        sim_time = self._window[-1][1] - self._start_sim_time
+        return "Real time: simulated {:.3f}s in {:.3f}s (real-time factor {:.3f}), min. slack {:.3f}s, slept {:.3f}s." \
+            .format(sim_time, wall_time, sim_time / max(wall_time, 1e-9), self.min_slack, self.sleep_time)
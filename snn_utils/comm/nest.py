@@ -3,8 +3,16 @@
 import logging
 import numpy as np
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 import nest
 
+from snn_utils.comm.packing import WeightStreamEncoder, pack_spikes
+from snn_utils.comm.worker import BackgroundWorker
+
 logger = logging.getLogger(__name__)
 
 
@@ -12,13 +20,38 @@ class WeightCommunicator(object):
     """
         Utility component for gathering and broadcasting weights via ZMQ.
         Weights of registered connections are pulled and broadcasted each time `communicate` is called.
+
+        In `streaming` mode, the static connection topology is only sent once per epoch and weights are sent as
+        packed float32 frames, optionally only those which changed by more than `tolerance`
+        (see `snn_utils.comm.packing.WeightStreamEncoder`; decode with `WeightStreamDecoder`).
+
+        Connection sets may be registered with a publish `interval` [sim-time], in which case `communicate`
+        skips them until the interval has passed. If `asynchronous` is set, `communicate` only copies the weights
+        into reusable snapshot arrays; serialization and sending happen on a background thread, which then
+        exclusively uses `send`. At most `max_pending` snapshots per key are in flight, `communicate` blocks
+        beyond that. Call `close` to flush pending snapshots.
+
+        With `sparse`, messages describe each connection set as a sparse (COO) matrix of local ids with an
+        explicit `shape` and without gid columns (see `snn_utils.sparse.SparseWeightMatrix.from_message`).
     """
 
-    def __init__(self, send, serialize=lambda data: repr(data), prefix="weight"):
+    def __init__(self, send, serialize=lambda data: repr(data), prefix="weight", streaming=False, tolerance=None,
+                 epoch_length=None, asynchronous=False, max_pending=2, sparse=False):
         self._serialize = serialize
+        self._sparse = sparse
         self._prefix = prefix
         self._conn_spec = {}
         self._send = send
+        self._streaming = streaming
+        self._tolerance = tolerance
+        self._epoch_length = epoch_length
+        self._encoders = {}
+        # key -> [interval, last publish time]
+        self._schedule = {}
+        self._max_pending = max_pending
+        # key -> queue of free snapshot arrays
+        self._snapshots = {}
+        self._worker = BackgroundWorker(name="weight-publisher") if asynchronous else None
 
     @staticmethod
     def _create_base_message(pre, post, conns):
@@ -30,12 +63,131 @@ class WeightCommunicator(object):
             'trg_lid': conns_col[1] - min(post),
         }
 
-    def add_conn_spec(self, key, pre, post, conns):
+    @staticmethod
+    def _create_sparse_base_message(pre, post, conns):
+        conns_col = np.rollaxis(np.array(conns), 1)
+        return {
+            'format': 'coo',
+            'shape': (int(max(pre) - min(pre) + 1), int(max(post) - min(post) + 1)),
+            'src_lid': (conns_col[0] - min(pre)).astype(np.int32),
+            'trg_lid': (conns_col[1] - min(post)).astype(np.int32),
+        }
+
+    def add_conn_spec(self, key, pre, post, conns, interval=None):
         assert key not in self._conn_spec, "association between prefix and connection specification should be unique"
-        self._conn_spec[key] = (conns, WeightCommunicator._create_base_message(pre, post, conns))
+        if self._sparse:
+            base_message = WeightCommunicator._create_sparse_base_message(pre, post, conns)
+        else:
+            base_message = WeightCommunicator._create_base_message(pre, post, conns)
+        self._conn_spec[key] = (conns, base_message)
+        self._schedule[key] = [interval, None]
+        if self._streaming:
+            self._encoders[key] = WeightStreamEncoder(self._conn_spec[key][1], self._tolerance, self._epoch_length)
+        if self._worker is not None:
+            self._snapshots[key] = queue.Queue()
+            for _ in range(self._max_pending):
+                self._snapshots[key].put(np.empty(len(conns), dtype=np.double))
+
+    def new_epoch(self):
+        """
+            Resends the topology and a full weight frame with the next `communicate` call in streaming mode,
+            e.g. after a new subscriber connected.
+        """
+        for encoder in self._encoders.values():
+            encoder.new_epoch()
+
+    def _topic(self, key):
+        return "{prefix}/{key}".format(prefix=self._prefix, key=key).encode()
+
+    def _stream(self, key, sim_time, weights):
+        for header, arrays in self._encoders[key].encode(sim_time, weights):
+            header = self._serialize(header)
+            if not isinstance(header, bytes):
+                header = header.encode()
+            self._send([self._topic(key), header] + arrays)
+
+    def _publish(self, key, sim_time, weights):
+        if self._streaming:
+            self._stream(key, sim_time, weights)
+        else:
+            msg = self._conn_spec[key][1]
+            msg['sim_time'] = sim_time
+            msg['weight'] = weights
+            self._send([self._topic(key), self._serialize(msg)])
+
+    def _publish_snapshot(self, key, sim_time, snapshot):
+        try:
+            self._publish(key, sim_time, snapshot)
+        finally:
+            self._snapshots[key].put(snapshot)
+
+    def _is_due(self, key, sim_time):
+        interval, last_time = self._schedule[key]
+        # tolerate rounding errors of accumulated simulation times
+        if interval is not None and last_time is not None and sim_time - last_time < interval - 1e-9:
+            return False
+        self._schedule[key][1] = sim_time
+        return True
 
     def communicate(self, sim_time):
         for key, (conns, msg) in self._conn_spec.items():
-            msg['sim_time'] = sim_time
-            msg['weight'] = nest.GetStatus(conns, 'weight')
-            self._send(["{prefix}/{key}".format(prefix=self._prefix, key=key).encode(), self._serialize(msg)])
+            if not self._is_due(key, sim_time):
+                continue
+            if self._worker is None:
+                self._publish(key, sim_time, nest.GetStatus(conns, 'weight'))
+            else:
+                snapshot = self._snapshots[key].get()
+                snapshot[:] = nest.GetStatus(conns, 'weight')
+                self._worker.submit(self._publish_snapshot, key, sim_time, snapshot)
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.close()
+
+
+class SpikeCommunicator(object):
+    """
+        Utility component for streaming spikes recorded by NEST spike detectors via ZMQ.
+        Each time `communicate` is called, only the events recorded since the previous call are read and
+        sent as packed (time, sender-lid) arrays, i.e. `[topic, header, times, lids]` (see `packing.unpack_spikes`
+        and `ProxyDataSource.read_packed_events`).
+
+        New events are determined by resetting the detector's `n_events` after reading (`reset`, default) or
+        by keeping a cursor into the recorded events otherwise. Times are multiplied by `time_scale`,
+        which by default converts from NEST's milliseconds to seconds.
+    """
+
+    def __init__(self, send, serialize=lambda data: repr(data), prefix="spikes", reset=True, time_scale=1e-3):
+        self._serialize = serialize
+        self._prefix = prefix
+        self._send = send
+        self._reset = reset
+        self._time_scale = time_scale
+        # key -> [detector, first gid of the population, cursor]
+        self._detectors = {}
+
+    def add_detector(self, key, detector, population):
+        assert key not in self._detectors, "association between prefix and spike detector should be unique"
+        self._detectors[key] = [detector, min(population), 0]
+
+    def _read_events(self, key):
+        detector, min_gid, cursor = self._detectors[key]
+        events = nest.GetStatus(detector, 'events')
+        times = np.concatenate([np.asarray(e['times'], dtype=np.double) for e in events])
+        senders = np.concatenate([np.asarray(e['senders']) for e in events])
+        if self._reset:
+            nest.SetStatus(detector, 'n_events', 0)
+        else:
+            assert len(detector) == 1, "cursors are only supported for single spike detectors"
+            self._detectors[key][2] = len(times)
+            times, senders = times[cursor:], senders[cursor:]
+        return times * self._time_scale, senders - min_gid
+
+    def communicate(self, sim_time):
+        for key in self._detectors.keys():
+            times, lids = self._read_events(key)
+            header = self._serialize({'sim_time': sim_time * self._time_scale, 'n_events': len(times)})
+            if not isinstance(header, bytes):
+                header = header.encode()
+            topic = "{prefix}/{key}".format(prefix=self._prefix, key=key).encode()
+            self._send([topic, header] + pack_spikes(times, lids))
@@ -0,0 +1,157 @@
+"""
+    Compact binary encodings of simulation data for multipart messages, e.g.
+    `[topic, header, array, ...]`, where the header is serialized and arrays are sent as raw frames.
+"""
+
+import ast
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOPOLOGY_DTYPES = [('src_gid', np.int64), ('trg_gid', np.int64), ('src_lid', np.int32), ('trg_lid', np.int32)]
+WEIGHT_DTYPE = np.float32
+INDEX_DTYPE = np.uint32
+SPIKE_TIME_DTYPE = np.float64
+
+
+def _deserialize_header(header):
+    return ast.literal_eval(header.decode() if isinstance(header, bytes) else header)
+
+
+class WeightStreamEncoder(object):
+    """
+        Encodes successive weight snapshots of a fixed set of connections.
+
+        The topology is sent once per epoch, followed by a full float32 weight frame.
+        Subsequent frames only contain the indices and values of weights which changed by more than `tolerance`
+        since they were last transmitted (all changes if `tolerance` is 0, full frames if it is None).
+        A new epoch, which allows subscribers connected in the meantime to catch up, is started every
+        `epoch_length` frames or on `new_epoch`.
+    """
+
+    def __init__(self, topology, tolerance=None, epoch_length=None):
+        self._fields = [name for name, _ in TOPOLOGY_DTYPES if name in topology]
+        self._topology = [np.ascontiguousarray(topology[name], dtype=dtype) for name, dtype in TOPOLOGY_DTYPES
+                          if name in topology]
+        self._shape = topology.get('shape')
+        self._tolerance = tolerance
+        self._epoch_length = epoch_length
+        self._epoch = -1
+        self._reference = None
+        self._frames_in_epoch = 0
+
+    def new_epoch(self):
+        self._reference = None
+
+    def encode(self, sim_time, weights):
+        """
+            Returns a list of (header, arrays) tuples which have to be sent in order.
+        """
+        weights = np.asarray(weights, dtype=WEIGHT_DTYPE)
+        messages = []
+        if self._reference is None or (self._epoch_length is not None and self._frames_in_epoch >= self._epoch_length):
+            self._epoch += 1
+            self._frames_in_epoch = 0
+            self._reference = None
+            messages.append(({'kind': 'topology', 'epoch': self._epoch, 'sim_time': sim_time,
+                              'size': len(weights), 'fields': self._fields, 'shape': self._shape}, self._topology))
+
+        header = {'epoch': self._epoch, 'sim_time': sim_time}
+        changed = None
+        if self._reference is not None and self._tolerance is not None:
+            changed = np.flatnonzero(np.abs(weights - self._reference) > self._tolerance).astype(INDEX_DTYPE)
+            if changed.nbytes + changed.size * weights.itemsize >= weights.nbytes:
+                # a delta frame would not be smaller
+                changed = None
+
+        if changed is None:
+            self._reference = weights.copy()
+            header['kind'] = 'full'
+            # frames may be sent without copying, hence never hand out the reference itself
+            messages.append((header, [self._reference.copy()]))
+        else:
+            values = weights[changed]
+            self._reference[changed] = values
+            header['kind'] = 'delta'
+            messages.append((header, [changed, values]))
+        self._frames_in_epoch += 1
+        return messages
+
+
+class WeightStreamDecoder(object):
+    """
+        Reconstructs weight messages from the frames produced by `WeightStreamEncoder`.
+        `decode` returns a message of the same layout as non-streaming `WeightCommunicator` messages,
+        or None as long as no complete snapshot is available (e.g. before the first topology of an epoch arrived).
+    """
+
+    def __init__(self, deserialize=_deserialize_header):
+        self._deserialize = deserialize
+        self._epoch = None
+        self._topology = None
+        self._weights = None
+
+    def decode(self, frames):
+        """
+            :param frames: raw frames `[header, array, ...]` of a multipart message, without topic.
+        """
+        header = self._deserialize(frames[0])
+        kind = header['kind']
+        if kind == 'topology':
+            self._epoch = header['epoch']
+            dtypes = dict(TOPOLOGY_DTYPES)
+            fields = header.get('fields', [name for name, _ in TOPOLOGY_DTYPES])
+            self._topology = dict((name, np.frombuffer(frame, dtype=dtypes[name]))
+                                  for name, frame in zip(fields, frames[1:]))
+            if header.get('shape') is not None:
+                self._topology['shape'] = tuple(header['shape'])
+            self._weights = None
+            return None
+        if header['epoch'] != self._epoch:
+            logger.debug("Skipping weight frame of epoch {} (current {})".format(header['epoch'], self._epoch))
+            return None
+        if kind == 'full':
+            self._weights = np.frombuffer(frames[1], dtype=WEIGHT_DTYPE).copy()
+        elif kind == 'delta':
+            if self._weights is None:
+                return None
+            self._weights[np.frombuffer(frames[1], dtype=INDEX_DTYPE)] = np.frombuffer(frames[2], dtype=WEIGHT_DTYPE)
+        else:
+            raise ValueError("Unknown weight frame kind: {}".format(kind))
+
+        msg = dict(self._topology)
+        msg['sim_time'] = header['sim_time']
+        msg['weight'] = self._weights.copy()
+        return msg
+
+
+def pack_spikes(times, lids):
+    """
+        Returns the frames `[times, lids]` for a batch of spike events, see `unpack_spikes`.
+    """
+    return [np.ascontiguousarray(times, dtype=SPIKE_TIME_DTYPE), np.ascontiguousarray(lids, dtype=INDEX_DTYPE)]
+
+
+def unpack_spikes(frames, deserialize=_deserialize_header):
+    """
+        :param frames: raw frames `[header, times, lids]` of a multipart message, without topic.
+        :return: tuple (sim_time, times, lids)
+    """
+    header = deserialize(frames[0])
+    return (header['sim_time'], np.frombuffer(frames[1], dtype=SPIKE_TIME_DTYPE),
+            np.frombuffer(frames[2], dtype=INDEX_DTYPE))
+
+
+def group_by_index(indices, values):
+    """
+        Yields `(index, values of index)` for all distinct indices (ascending), keeping the order of values per index.
+    """
+    indices = np.asarray(indices)
+    values = np.asarray(values)
+    order = np.argsort(indices, kind='stable')
+    indices = indices[order]
+    values = values[order]
+    starts = np.flatnonzero(np.diff(indices)) + 1
+    return zip(indices[np.concatenate(([0], starts))].tolist(), np.split(values, starts))
@@ -4,7 +4,9 @@ except ImportError:
     from collections import UserDict
 
 import collections
+import hashlib
 import itertools
+import os
 
 
 def _default(value, fallback, not_set=None):
@@ -42,7 +44,7 @@ class MusicPort(UserDict):
     EVENT_OUT = collections.namedtuple('EVENT_OUT', ['maxBuffered', 'perm', 'base', 'index_type', 'size'])
 
     def __init__(self, name, params=None):
-        UserDict.__init__(self, dict=params)
+        UserDict.__init__(self, params)
         self.name = name
 
     def __repr__(self):
@@ -111,7 +113,51 @@ class Node(object):
         return self.port(port_name)
 
 
+class _PortGroups(object):
+    """Disjoint sets (union-find) of port names, with path compression and union by size."""
+
+    def __init__(self):
+        self._parent = {}
+        self._size = {}
+
+    def add(self, name):
+        if name not in self._parent:
+            self._parent[name] = name
+            self._size[name] = 1
+
+    def find(self, name):
+        root = name
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[name] != root:
+            self._parent[name], name = root, self._parent[name]
+        return root
+
+    def union(self, name1, name2):
+        root1, root2 = self.find(name1), self.find(name2)
+        if root1 == root2:
+            return root1
+        if self._size[root1] < self._size[root2]:
+            root1, root2 = root2, root1
+        self._parent[root2] = root1
+        self._size[root1] += self._size[root2]
+        return root1
+
+    def groups(self):
+        result = collections.defaultdict(list)
+        for name in self._parent:
+            result[self.find(name)].append(name)
+        return result
+
+
 class MUSICConfig(object):
+    """Collection of nodes, their connections and global parameters of a MUSIC configuration.
+
+    Connected ports share their width, which is given either by a port parameter 'width' or by the connection.
+    Widths are propagated through groups of connected ports when the connections are requested (`connections`),
+    which reports all conflicting and unresolved groups at once.
+    """
+
     def __init__(self, default_host='localhost', global_params=None, port_defaults=None):
         self._default_host = default_host
         self._global_params = _default(global_params, {})
@@ -119,7 +165,9 @@ class MUSICConfig(object):
         self._nodes = {}
         self._connections = []
 
-        self._unresolved_port_groups = []
+        self._ports = {}
+        self._port_groups = _PortGroups()
+        self._connection_widths = []
 
     def _add_node(self, node):
         assert node.name not in self._nodes
@@ -149,30 +197,48 @@ class MUSICConfig(object):
     def add_connection(self, src_node, trg_node, src_port='out', trg_port='in', width=None):
         src_port = src_node.port(src_port)
         trg_port = trg_node.port(trg_port)
-
-        ports = {src_port.name, trg_port.name}
-
-        widths = set(w for w in [width, src_port.get('width', None), trg_port.get('width', None)] if w is not None)
-        assert len(widths) <= 1, "Inconsistent widths for ports {}: {}".format(ports, widths)
-        if widths:
-            width = widths.pop()
-
-        if width is not None:
-            for port in ports:
-                assert 'width' not in port or port['width'] == width
-                src_port['width'] = width
-            for pg in [pg for pg in self._unresolved_port_groups if pg.intersection(ports)]:
-                self._unresolved_port_groups.remove(pg)
-                for port in pg:
-                    assert 'width' not in port
-                    port['width'] = width
-        else:
-            port_groups = [pg for pg in self._unresolved_port_groups if pg.intersection(ports)]
-            for pg in port_groups:
-                self._unresolved_port_groups.remove(pg)
-            self._unresolved_port_groups.append(set.union(ports, *port_groups))
-
+        for port in [src_port, trg_port]:
+            self._ports[port.name] = port
+            self._port_groups.add(port.name)
+        self._port_groups.union(src_port.name, trg_port.name)
         self._connections.append((src_port, trg_port))
+        self._connection_widths.append(width)
+
+    def _resolve_widths(self):
+        # collect the sources of all widths per group of connected ports
+        widths = collections.defaultdict(lambda: collections.defaultdict(list))
+        find = self._port_groups.find
+        for name, port in self._ports.items():
+            if port.get('width', None) is not None:
+                widths[find(name)][port['width']].append(name)
+        for (src_port, trg_port), width in zip(self._connections, self._connection_widths):
+            if width is not None:
+                widths[find(src_port.name)][width].append("{} -> {}".format(src_port.name, trg_port.name))
+
+        resolved, conflicts, unresolved = {}, [], []
+        for root, names in self._port_groups.groups().items():
+            group_widths = widths.get(root, {})
+            if len(group_widths) > 1:
+                conflicts.append((sorted(names), group_widths))
+            elif not group_widths:
+                unresolved.append(sorted(names))
+            else:
+                resolved[root] = next(iter(group_widths))
+
+        errors = []
+        if conflicts:
+            errors.append("Inconsistent widths for the following connected port groups:\n{}".format("\n".join(
+                ["  - [{}]: {}".format(", ".join(names), "; ".join(
+                    ["{} ({})".format(w, ", ".join(sources)) for w, sources in sorted(group_widths.items())]))
+                 for names, group_widths in sorted(conflicts)])))
+        if unresolved:
+            errors.append("The width of the following connected port groups could not be resolved:\n{}"
+                          .format("\n".join(["  - [{}]".format(", ".join(names)) for names in sorted(unresolved)])))
+        if errors:
+            raise ValueError("\n".join(errors))
+
+        for name, port in self._ports.items():
+            port['width'] = resolved[find(name)]
 
     def __getitem__(self, node_name):
         assert node_name in self._nodes
@@ -185,10 +251,7 @@ class MUSICConfig(object):
         return dict([(name, node.n_processes) for name, node in self._nodes.items()])
 
     def connections(self):
-        if self._unresolved_port_groups:
-            raise ValueError("The width of the following connected port groups could not be resolved:\n{}"
-                             .format("\n".join(["  - [{}]".format(", ".join(map(str, pg)))
-                                                for pg in self._unresolved_port_groups])))
+        self._resolve_widths()
         return [(p1, p2, p1['width']) for p1, p2 in self._connections]
 
     def globals(self):
@@ -206,3 +269,69 @@ def gen_socket_ports(node_sizes, base_port):
             result[node] = result[(node, 0)]
     return result
 
+
+HASH_HEADER = "# generated by snn_utils, content hash: "
+
+
+def _format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _render_params(params, prefix=""):
+    return ["{}{}={}".format(prefix, key, _format_value(params[key])) for key in sorted(params)]
+
+
+def render_music_config(config, socket_base_port=None):
+    """Renders a MUSICConfig to the syntax of MUSIC configuration files.
+
+    Global parameters come first, followed by one section per node (in order of names) containing the binary,
+    the number of processes, the node parameters and the port parameters (except widths) as '<port>_<param>'.
+    The connections are listed in the section of their source node.
+    If `socket_base_port` is given, the ports of `gen_socket_ports` are added as node parameters
+    'socket_port_<rank>' (and 'socket_port' for single-process nodes).
+
+    :return: The lines of the configuration file.
+    """
+    connections = collections.defaultdict(list)
+    for src_port, trg_port, width in config.connections():
+        src_node_name = src_port.name.split('.', 1)[0]
+        connections[src_node_name].append("{} -> {} [{}]".format(src_port.name, trg_port.name, width))
+    socket_ports = gen_socket_ports(config.nodes_sizes(), socket_base_port) if socket_base_port is not None else {}
+
+    lines = _render_params(config.globals())
+    for name, node in sorted(config.nodes().items()):
+        node_params = node.params()
+        lines.append("[{}]".format(name))
+        lines.extend("  " + line for line in _render_params(dict([(k, node_params[k]) for k in ['binary', 'np']])))
+        lines.extend("  " + line for line in _render_params(
+            dict([(k, v) for k, v in node_params.items() if k not in ['binary', 'np']])))
+        if socket_ports:
+            lines.extend("  socket_port_{}={}".format(rank, socket_ports[(name, rank)])
+                         for rank in range(node.n_processes))
+            if name in socket_ports:
+                lines.append("  socket_port={}".format(socket_ports[name]))
+        for port_name, port in sorted(node.ports().items()):
+            port_params = dict([(k, v) for k, v in port.items() if k != 'width'])
+            lines.extend("  " + line for line in _render_params(port_params, prefix="{}_".format(port_name)))
+        lines.extend("  " + line for line in connections[name])
+    return lines
+
+
+def write_music_config(config, path, socket_base_port=None):
+    """Writes a MUSICConfig to the MUSIC configuration file `path`.
+
+    The first line holds a hash of the content; an existing file with the same hash is left untouched,
+    which keeps its modification time for repeated launches with the same configuration.
+
+    :return: True if the file has been (re)written.
+    """
+    content = "\n".join(render_music_config(config, socket_base_port)) + "\n"
+    header = HASH_HEADER + hashlib.sha1(content.encode('utf-8')).hexdigest() + "\n"
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.readline() == header:
+                return False
+    with open(path, 'w') as f:
+        f.write(header)
+        f.write(content)
+    return True
@@ -0,0 +1,94 @@
+import collections
+import math
+
+CONT_VALUE_SIZE = 8  # double
+EVENT_SIZE = 16  # time (double) and index (int), padded
+
+ConnectionTraffic = collections.namedtuple('ConnectionTraffic', ['src', 'trg', 'width', 'kind', 'bytes_per_tick',
+                                                                 'bytes_per_second', 'max_buffered', 'acc_latency'])
+NodeTraffic = collections.namedtuple('NodeTraffic', ['sent', 'received', 'sent_per_tick', 'received_per_tick'])
+
+
+def _timestep(config, node_name, default_timestep):
+    timestep = config[node_name].params().get('music_timestep',
+                                              config.globals().get('music_timestep', default_timestep))
+    if timestep is None:
+        raise ValueError("No music_timestep given for node {}".format(node_name))
+    return float(timestep)
+
+
+def _lookup_rate(event_rates, src_port, trg_port):
+    for name in ["{} -> {}".format(src_port.name, trg_port.name), src_port.name, trg_port.name]:
+        if name in event_rates:
+            return float(event_rates[name])
+    return None
+
+
+def estimate_traffic(config, event_rates=None, default_timestep=None):
+    """Estimates the data volume of all connections of a MUSICConfig.
+
+    Connections are continuous unless an event rate per channel [Hz] is given in `event_rates`, keyed by
+    connection ("src.port -> trg.port"), source or target port name. Continuous ports transfer
+    width * 8 bytes per tick of the source node, event ports rate * width * 16 bytes per second.
+    Ticks are given by the node parameter (or global) 'music_timestep' [s], falling back to `default_timestep`.
+
+    Suggestions per connection, based on the larger of both node timesteps, i.e. the latency at which the
+    target does not have to wait for the source each tick:
+      - `acc_latency` (event connections only): that latency in s, as expected by MUSIC ports (e.g. the
+        `accLatency` of `PortUtility.publish_event_input`). NEST (`nest.SetAcceptableLatency`) expects ms, i.e. 1000x.
+      - `max_buffered`: the number of source ticks within that latency (at least 1).
+
+    :return: (list of ConnectionTraffic, dict of node name -> NodeTraffic) with volumes in bytes, per second of
+             simulated time and per tick of the sending (connections, `sent_per_tick`) or receiving node.
+    """
+    event_rates = event_rates or {}
+    connections = []
+    sent = collections.defaultdict(float)
+    received = collections.defaultdict(float)
+    timesteps = {}
+    for src_port, trg_port, width in config.connections():
+        src_node, trg_node = src_port.name.split('.', 1)[0], trg_port.name.split('.', 1)[0]
+        src_timestep = timesteps[src_node] = _timestep(config, src_node, default_timestep)
+        trg_timestep = timesteps[trg_node] = _timestep(config, trg_node, default_timestep)
+        latency = max(src_timestep, trg_timestep)
+        max_buffered = max(1, int(math.ceil(latency / src_timestep - 1e-9)))
+        rate = _lookup_rate(event_rates, src_port, trg_port)
+        if rate is None:
+            kind, acc_latency = 'cont', None
+            bytes_per_tick = width * CONT_VALUE_SIZE
+        else:
+            kind, acc_latency = 'event', latency
+            bytes_per_tick = rate * width * EVENT_SIZE * src_timestep
+        bytes_per_second = bytes_per_tick / src_timestep
+        connections.append(ConnectionTraffic(src_port.name, trg_port.name, width, kind, bytes_per_tick,
+                                             bytes_per_second, max_buffered, acc_latency))
+        sent[src_node] += bytes_per_second
+        received[trg_node] += bytes_per_second
+    nodes = dict([(name, NodeTraffic(sent[name], received[name], sent[name] * timesteps.get(name, 0.0),
+                                     received[name] * timesteps.get(name, 0.0)))
+                  for name in config.nodes()])
+    return connections, nodes
+
+
+def _format_size(n_bytes):
+    for unit in ['B', 'KiB', 'MiB']:
+        if abs(n_bytes) < 1024.0:
+            return "{:.1f}{}".format(n_bytes, unit)
+        n_bytes /= 1024.0
+    return "{:.1f}GiB".format(n_bytes)
+
+
+def format_traffic_report(connections, nodes):
+    """Formats the result of `estimate_traffic`, connections and nodes ordered by decreasing volume."""
+    lines = ["Connections (per second of simulated time / per tick of the source):"]
+    for c in sorted(connections, key=lambda c: -c.bytes_per_second):
+        lines.append("  {} -> {} [{}] {:<5} {:>10}/s {:>10}/tick maxBuffered={}{}".format(
+            c.src, c.trg, c.width, c.kind, _format_size(c.bytes_per_second), _format_size(c.bytes_per_tick),
+            c.max_buffered, " accLatency={:g}s (NEST: {:g}ms)".format(c.acc_latency, c.acc_latency * 1000.0)
+            if c.acc_latency is not None else ""))
+    lines.append("Nodes (per second of simulated time / per tick of the node):")
+    for name, node in sorted(nodes.items(), key=lambda item: -(item[1].sent + item[1].received)):
+        lines.append("  {:<20} sent {:>10}/s {:>10}/tick received {:>10}/s {:>10}/tick".format(
+            name, _format_size(node.sent), _format_size(node.sent_per_tick), _format_size(node.received),
+            _format_size(node.received_per_tick)))
+    return "\n".join(lines)
@@ -0,0 +1,64 @@
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWorker(object):
+    """
+        Executes submitted tasks in order of submission on a single daemon thread.
+        At most `max_queue` tasks are pending (unbounded if 0). While the queue is full, `submit` either blocks
+        (`drop=False`) or drops the task (`drop=True`).
+        `dropped` counts dropped tasks and `max_depth` is the highest number of pending tasks seen on submission.
+    """
+
+    def __init__(self, max_queue=0, name=None, drop=False):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._drop = drop
+        self.n_submitted = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self._thread = threading.Thread(target=self._loop, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            fn, args = task
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception("Error occurred while executing background task {}".format(fn))
+
+    def submit(self, fn, *args):
+        """
+            Returns whether the task has been queued (i.e. False if it has been dropped).
+        """
+        try:
+            self._queue.put((fn, args), block=not self._drop)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.n_submitted += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def metrics(self):
+        return {'depth': self.depth(), 'max_depth': self.max_depth, 'submitted': self.n_submitted,
+                'dropped': self.dropped}
+
+    def close(self, wait=True):
+        self._queue.put(None)
+        if wait:
+            self._thread.join()
@@ -1,10 +1,21 @@
 
+import collections
+import copy
+import functools
+import struct
 import time
 import logging
 import zmq
 
+from concurrent import futures
+
 logger = logging.getLogger(__name__)
 
+# format of the optional trailing send timestamp frame of multipart messages
+TIMESTAMP_FORMAT = '<d'
+# frames smaller than this [bytes] are copied by `Publisher.send_buffers`, as zero-copy sends have a fixed overhead
+COPY_THRESHOLD = 64 * 1024
+
 
 class ContextHelper(object):
     def __init__(self, context=None):
@@ -17,37 +28,358 @@ class ContextHelper(object):
             self._context.term()
 
 
+class DeliveryPolicy(object):
+    """
+        Decides which messages of a topic are passed on. This base policy keeps all messages.
+        Policies are registered for topic prefixes and copied for each distinct topic they are applied to.
+    """
+
+    conflate = False
+
+    def __init__(self):
+        self.dropped = 0
+
+    def admit(self, now):
+        return True
+
+
+class ConflatePolicy(DeliveryPolicy):
+    """
+        Latest-value delivery: only the newest message of a topic received during one `MultiSubscriber.tick`
+        is deserialized and delivered. Senders pass all messages.
+    """
+
+    conflate = True
+
+
+class RateLimitPolicy(DeliveryPolicy):
+    """
+        Passes at most `max_rate` messages per second [real-time].
+        If `conflate` is set, a subscriber holds back the latest message until it may be delivered,
+        otherwise surplus messages are dropped.
+    """
+
+    def __init__(self, max_rate, conflate=False):
+        DeliveryPolicy.__init__(self)
+        assert max_rate > 0
+        self._interval = 1.0 / max_rate
+        self._last_admitted = None
+        self.conflate = conflate
+
+    def admit(self, now):
+        if self._last_admitted is not None and now - self._last_admitted < self._interval:
+            return False
+        self._last_admitted = now
+        return True
+
+
+class TopicPolicies(object):
+    """
+        Maps topics to the delivery policy registered for their longest matching prefix.
+    """
+
+    def __init__(self, policies=None):
+        self._templates = []
+        self._policies = {}
+        for prefix, policy in (policies or {}).items():
+            self.add(prefix, policy)
+
+    def add(self, prefix, policy):
+        if not isinstance(prefix, bytes):
+            prefix = prefix.encode()
+        self._templates.append((prefix, policy))
+        self._templates.sort(key=lambda prefix_policy: len(prefix_policy[0]), reverse=True)
+        self._policies.clear()
+
+    def __bool__(self):
+        return bool(self._templates)
+
+    __nonzero__ = __bool__
+
+    def get(self, topic, exact=True):
+        """
+            Returns a tuple (key, policy) with the policy instance responsible for `topic`.
+            If `exact` is false, `topic` is an arbitrary message and the state is shared per matching prefix.
+        """
+        if exact and topic in self._policies:
+            return topic, self._policies[topic]
+        for prefix, template in self._templates:
+            if topic.startswith(prefix):
+                key = topic if exact else prefix
+                if key not in self._policies:
+                    self._policies[key] = copy.copy(template)
+                return key, self._policies[key]
+        if exact:
+            self._policies[topic] = None
+        return topic, None
+
+    def dropped_counts(self):
+        return dict((key.decode(errors='replace'), policy.dropped) for key, policy in self._policies.items()
+                    if policy is not None and policy.dropped)
+
+
+class _TopicStats(object):
+    __slots__ = ['messages', 'bytes', 'codec_time', 'codec_count', 'latency_sum', 'latency_max', 'latency_count']
+
+    def __init__(self):
+        self.messages = self.bytes = self.codec_count = self.latency_count = 0
+        self.codec_time = self.latency_sum = self.latency_max = 0.0
+
+
+class TransportStats(object):
+    """
+        Opt-in per-topic transport counters: messages, bytes, (de)serialization time and send-to-handler latency.
+        If `log_interval` [s, real-time] is set, a summary line is logged at most once per interval.
+    """
+
+    def __init__(self, name, log_interval=None):
+        self._name = name
+        self._log_interval = log_interval
+        self._last_log = time.time()
+        self._topics = collections.defaultdict(_TopicStats)
+
+    def record_message(self, topic, n_bytes):
+        stats = self._topics[topic]
+        stats.messages += 1
+        stats.bytes += n_bytes
+
+    def record_codec_time(self, topic, seconds):
+        stats = self._topics[topic]
+        stats.codec_time += seconds
+        stats.codec_count += 1
+
+    def record_latency(self, topic, seconds):
+        stats = self._topics[topic]
+        stats.latency_sum += seconds
+        stats.latency_max = max(stats.latency_max, seconds)
+        stats.latency_count += 1
+
+    def snapshot(self):
+        result = {}
+        for topic, stats in self._topics.items():
+            result[topic.decode(errors='replace') if isinstance(topic, bytes) else topic] = {
+                'messages': stats.messages,
+                'bytes': stats.bytes,
+                'codec_time': stats.codec_time,
+                'mean_codec_time': stats.codec_time / stats.codec_count if stats.codec_count else None,
+                'mean_latency': stats.latency_sum / stats.latency_count if stats.latency_count else None,
+                'max_latency': stats.latency_max if stats.latency_count else None,
+            }
+        return result
+
+    def reset(self):
+        self._topics.clear()
+
+    def format(self):
+        def fmt_time(value):
+            return "-" if value is None else "{:.2f}ms".format(value * 1000.0)
+
+        return "; ".join(["{} {} msgs {:.1f}kB codec {} latency {} (max {})".format(
+            topic, stats['messages'], stats['bytes'] / 1024.0, fmt_time(stats['mean_codec_time']),
+            fmt_time(stats['mean_latency']), fmt_time(stats['max_latency']))
+            for topic, stats in sorted(self.snapshot().items())])
+
+    def maybe_log(self, now=None):
+        if self._log_interval is None:
+            return
+        now = time.time() if now is None else now
+        if now - self._last_log >= self._log_interval:
+            self._last_log = now
+            logger.info("[{}] {}".format(self._name, self.format()))
+
+
+def _create_stats(name, instrument, log_interval):
+    if isinstance(instrument, TransportStats):
+        return instrument
+    return TransportStats(name, log_interval) if instrument else None
+
+
+def _frame_size(frame):
+    if isinstance(frame, (bytes, str)):
+        return len(frame)
+    return memoryview(frame).nbytes
+
+
 class Publisher(ContextHelper):
     """
         Minimal wrapper around a ZMQ publisher.
+
+        Per-topic delivery policies (see `DeliveryPolicy`) can be registered to rate limit topics on the sending side.
+        `send_hwm` bounds the number of messages queued per subscriber.
+
+        If `instrument` is set (or a `TransportStats` instance is given), per-topic transport statistics are recorded.
+        With `timestamps`, a send timestamp frame is appended to each multipart message; subscribers have to
+        be added with `timestamped=True` to strip it and measure latencies.
     """
-    def __init__(self, port, context=None, host="*", transport='tcp'):
+    def __init__(self, port, context=None, host="*", transport='tcp', send_hwm=None, policies=None,
+                 instrument=False, timestamps=False, log_interval=None):
         ContextHelper.__init__(self, context)
         address = "{}://{}:{}".format(transport, host, port)
         logger.info("Publishing on {}".format(address))
         self._sock = self._context.socket(zmq.PUB)
+        if send_hwm is not None:
+            self._sock.setsockopt(zmq.SNDHWM, send_hwm)
         self._sock.bind(address)
+        self._policies = TopicPolicies(policies)
+        self._stats = _create_stats("publisher {}".format(address), instrument, log_interval)
+        self._timestamps = timestamps
+
+    def set_topic_policy(self, prefix, policy):
+        self._policies.add(prefix, policy)
+
+    def _admit(self, topic, exact=True):
+        if not self._policies:
+            return True
+        _, policy = self._policies.get(topic, exact)
+        if policy is None or policy.admit(time.time()):
+            return True
+        policy.dropped += 1
+        return False
 
     def send(self, data):
-        self._sock.send(data)
+        if self._admit(data, exact=False):
+            if self._stats is not None:
+                self._stats.record_message(b'', _frame_size(data))
+                self._stats.maybe_log()
+            self._sock.send(data)
 
     def send_multipart(self, *data):
-        self._sock.send_multipart(*data)
+        frames = data[0]
+        if self._admit(frames[0]):
+            self._send_multipart(frames, *data[1:])
+
+    def _send_multipart(self, frames, *args, **kwargs):
+        # all multipart messages are sent here (subclasses may transform the frames);
+        # with `copy_threshold`, frames are sent as buffers (see `send_buffers`)
+        copy_threshold = kwargs.pop('copy_threshold', None)
+        frames = list(frames)
+        if self._timestamps:
+            frames.append(struct.pack(TIMESTAMP_FORMAT, time.time()))
+        if self._stats is not None:
+            self._stats.record_message(frames[0], sum(map(_frame_size, frames)))
+            self._stats.maybe_log()
+        if copy_threshold is None:
+            return self._sock.send_multipart(frames, *args, **kwargs)
+        return self._send_frame_buffers(frames, copy_threshold, **kwargs)
+
+    def _send_frame_buffers(self, frames, copy_threshold, track=False):
+        trackers = []
+        last = len(frames) - 1
+        for i, frame in enumerate(frames):
+            if isinstance(frame, bytes):
+                zero_copy = len(frame) >= copy_threshold
+            else:
+                view = memoryview(frame)
+                if not view.contiguous:
+                    frame = view.tobytes()
+                zero_copy = view.contiguous and view.nbytes >= copy_threshold
+            tracker = self._sock.send(frame, zmq.SNDMORE if i < last else 0, copy=not zero_copy,
+                                      track=track and zero_copy)
+            if tracker is not None:
+                trackers.append(tracker)
+        return zmq.MessageTracker(*trackers) if trackers else None
+
+    def send_buffers(self, frames, track=False, copy_threshold=COPY_THRESHOLD):
+        """
+            Sends a multipart message whose frames may also be NumPy arrays, memoryviews or other buffers.
+
+            Contiguous frames of at least `copy_threshold` bytes are handed to ZMQ without copying,
+            smaller frames are copied. Hence, the buffers of large frames must not be modified until ZMQ is done
+            with them: with `track`, a `zmq.MessageTracker` covering all zero-copy frames is returned
+            (None if no frame was sent without copying or the message was dropped by a delivery policy).
+        """
+        if not self._admit(frames[0]):
+            return None
+        return self._send_multipart(frames, track=track, copy_threshold=copy_threshold)
+
+    def send_objects(self, topic, objs, serialize):
+        """
+            Serializes each of `objs` and sends them as multipart message under `topic`.
+            Messages dropped by the topic's policy are not serialized.
+            Serialization time is recorded if instrumentation is enabled.
+        """
+        if not isinstance(topic, bytes):
+            topic = topic.encode()
+        if not self._admit(topic):
+            return
+        before = time.time()
+        frames = [topic] + [serialize(obj) for obj in objs]
+        if self._stats is not None:
+            self._stats.record_codec_time(topic, time.time() - before)
+        self._send_multipart(frames)
+
+    def dropped_counts(self):
+        return self._policies.dropped_counts()
+
+    def stats(self):
+        return self._stats.snapshot() if self._stats is not None else None
 
     def close(self):
+        dropped = self.dropped_counts()
+        if dropped:
+            logger.info("Dropped messages per topic: {}".format(dropped))
         logger.info("Closing socket")
         self._sock.close()
         ContextHelper.close(self)
 
 
+def _deserialize_message(deserialize, multipart, msg):
+    # module level function, such that it can be shipped to a process pool
+    if multipart:
+        return [elem.decode() if i == 0 else deserialize(elem) for i, elem in enumerate(msg)]
+    else:
+        return deserialize(msg)
+
+
+def _timed_deserialize_message(deserialize, multipart, msg):
+    before = time.time()
+    data = _deserialize_message(deserialize, multipart, msg)
+    return data, time.time() - before
+
+
+def _create_executor(pool, max_workers):
+    if pool is None or isinstance(pool, futures.Executor):
+        return pool, False
+    if pool == 'thread':
+        return futures.ThreadPoolExecutor(max_workers=max_workers or 4), True
+    if pool == 'process':
+        return futures.ProcessPoolExecutor(max_workers=max_workers), True
+    raise ValueError("Unknown deserialization pool: {}".format(pool))
+
+
 class MultiSubscriber(ContextHelper):
-    def __init__(self, context=None, poll_timeout=0.000000001):
+    """
+        Polls an arbitrary number of ZMQ subscriber sockets and dispatches received messages to callbacks.
+
+        Deserialization can be moved off the polling thread by passing `deserialize_pool`,
+        which is either 'thread', 'process' or an existing `concurrent.futures.Executor`.
+        Messages are still delivered to the callbacks in the thread calling `tick`, in the order they were received
+        on the corresponding socket. Note that a process pool requires picklable `deserialize` functions,
+        e.g. `SERIALIZERS['pickle'].deserialize`.
+
+        Subscribers may be given per-topic delivery policies (see `DeliveryPolicy`). Messages of conflated topics
+        are held back until the sockets are exhausted, such that only the latest one is deserialized and delivered.
+
+        With `instrument`, per-topic transport statistics are recorded (see `TransportStats`).
+    """
+
+    def __init__(self, context=None, poll_timeout=0.000000001, deserialize_pool=None, pool_workers=None,
+                 instrument=False, log_interval=None):
         ContextHelper.__init__(self, context)
         self._poller = zmq.Poller()
         self._handler = {}
         self._poll_timeout = poll_timeout
+        self._executor, self.__scoped_executor = _create_executor(deserialize_pool, pool_workers)
+        # per socket queues of (message, send time, future, deliver) in order of reception
+        self._pending = collections.OrderedDict()
+        # latest messages of conflated topics: (socket, topic) -> (policy, message, send time, process)
+        self._conflated = collections.OrderedDict()
+        self._policies = []
+        self._stats = _create_stats("subscriber", instrument, log_interval)
 
-    def add_subscriber(self, host, port, callback, transport="tcp", prefix="", deserialize=None, multipart=False):
+    def add_subscriber(self, host, port, callback, transport="tcp", prefix="", deserialize=None, multipart=False,
+                       offload_deserialize=True, policies=None, timestamped=False):
+        assert multipart or not timestamped, "Send timestamps are only supported for multipart messages"
         address = "{}://{}:{}".format(transport, host, port)
         logger.info("Subscribing to {}".format(address))
         sock = self._context.socket(zmq.SUB)
@@ -61,23 +393,103 @@ class MultiSubscriber(ContextHelper):
             def receive():
                 return sock.recv(zmq.NOBLOCK)
 
-        def handle():
-            msg = receive()
+        stats = self._stats
+        decode = None
+        if deserialize:
+            decode = functools.partial(_deserialize_message if stats is None else _timed_deserialize_message,
+                                       deserialize, multipart)
+        subscription = prefix.encode()
+
+        def topic_of(msg):
+            return msg[0] if multipart else subscription
 
+        def deliver(msg, data, sent_time):
             try:
-                data = msg
-                if deserialize:
-                    if multipart:
-                        data = [elem.decode() if i == 0 else deserialize(elem) for i, elem in enumerate(msg)]
-                    else:
-                        data = deserialize(msg)
+                if stats is not None:
+                    if decode is not None:
+                        data, elapsed = data
+                        stats.record_codec_time(topic_of(msg), elapsed)
+                    if sent_time is not None:
+                        stats.record_latency(topic_of(msg), time.time() - sent_time)
                 return callback(data)
-            except:
+            except Exception:
                 logger.exception("Error occurred while handling message '{}'".format(msg))
 
+        if decode is not None and offload_deserialize and self._executor is not None:
+            pending = self._pending[sock] = collections.deque()
+
+            def process(msg, sent_time):
+                pending.append((msg, sent_time, self._executor.submit(decode, msg), deliver))
+        else:
+            def process(msg, sent_time):
+                data = msg
+                if decode is not None:
+                    try:
+                        data = decode(msg)
+                    except Exception:
+                        logger.exception("Error occurred while handling message '{}'".format(msg))
+                        return
+                return deliver(msg, data, sent_time)
+
+        topic_policies = TopicPolicies(policies)
+        if topic_policies:
+            self._policies.append(topic_policies)
+
+        def handle():
+            msg = receive()
+            sent_time = None
+            if timestamped:
+                sent_time = struct.unpack(TIMESTAMP_FORMAT, msg.pop())[0]
+            if stats is not None:
+                stats.record_message(topic_of(msg), sum(map(_frame_size, msg)) if multipart else _frame_size(msg))
+            if not topic_policies:
+                return process(msg, sent_time)
+            topic, policy = topic_policies.get(msg[0] if multipart else msg, exact=multipart)
+            if policy is None:
+                process(msg, sent_time)
+            elif policy.conflate:
+                if (sock, topic) in self._conflated:
+                    policy.dropped += 1
+                self._conflated[(sock, topic)] = (policy, msg, sent_time, process)
+            elif policy.admit(time.time()):
+                process(msg, sent_time)
+            else:
+                policy.dropped += 1
+
         self._handler[sock] = handle
         self._poller.register(sock, zmq.POLLIN)
 
+    def _deliver_pending(self):
+        for pending in self._pending.values():
+            # preserve order of reception: stop at the first message which is not decoded yet
+            while pending and pending[0][2].done():
+                msg, sent_time, future, deliver = pending.popleft()
+                try:
+                    data = future.result()
+                except Exception:
+                    logger.exception("Error occurred while handling message '{}'".format(msg))
+                    continue
+                deliver(msg, data, sent_time)
+
+    def _deliver_conflated(self):
+        now = time.time()
+        for key, (policy, msg, sent_time, process) in list(self._conflated.items()):
+            if policy.admit(now):
+                del self._conflated[key]
+                process(msg, sent_time)
+
+    def n_pending(self):
+        return sum(len(pending) for pending in self._pending.values())
+
+    def dropped_counts(self):
+        result = collections.Counter()
+        for topic_policies in self._policies:
+            result.update(topic_policies.dropped_counts())
+        return dict(result)
+
+    def stats(self):
+        return self._stats.snapshot() if self._stats is not None else None
+
     def tick(self, max_polls=1000):
         # exhaustive poll
         polled = []
@@ -85,14 +497,27 @@ class MultiSubscriber(ContextHelper):
         polls = 0
         while not exhausted and polls < max_polls:
             for sock, kind in polled:
-                assert kind is zmq.POLLIN
+                assert kind == zmq.POLLIN
                 self._handler[sock]()
+            self._deliver_pending()
             polled = self._poller.poll(self._poll_timeout)
             exhausted = not polled
             polls += 1
+        if self._conflated:
+            self._deliver_conflated()
+            self._deliver_pending()
+        if self._stats is not None:
+            self._stats.maybe_log()
 
     def close(self):
+        dropped = self.dropped_counts()
+        if dropped:
+            logger.info("Dropped messages per topic: {}".format(dropped))
         logger.info("Closing {} sockets.".format(len(self._handler.keys())))
         for sock in self._handler.keys():
             sock.close()
+        if self._executor is not None:
+            if self.__scoped_executor:
+                self._executor.shutdown(wait=False)
+            self._pending.clear()
         ContextHelper.close(self)
@@ -0,0 +1,199 @@
+import ast
+import logging
+import struct
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from snn_utils.comm.zmq import Publisher, MultiSubscriber
+
+logger = logging.getLogger(__name__)
+
+# ring header: capacity and total number of bytes reserved so far (monotonic)
+_HEADER = struct.Struct('<QQ')
+_ALIGNMENT = 64
+
+
+def _attach_shared_memory(name):
+    try:
+        # python >= 3.13: do not let the resource tracker of this process unlink the segment of the writer
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            logger.debug("Could not unregister shared memory segment {} from the resource tracker".format(name))
+        return shm
+
+
+class SharedMemoryRing(object):
+    """
+        Single writer ring buffer in a shared memory segment.
+
+        Regions are addressed by their absolute (monotonic) start offset.
+        The writer reserves a region before writing into it, hence a reader can detect whether
+        a region has been (or is being) overwritten via `is_valid`.
+    """
+
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self._owner = owner
+        self._data = np.ndarray((shm.size - _HEADER.size,), dtype=np.uint8, buffer=shm.buf, offset=_HEADER.size)
+        self.capacity, self._head = _HEADER.unpack_from(shm.buf, 0)
+
+    @staticmethod
+    def create(capacity, name=None):
+        assert capacity > 0
+        shm = shared_memory.SharedMemory(name=name, create=True, size=_HEADER.size + capacity)
+        _HEADER.pack_into(shm.buf, 0, capacity, 0)
+        return SharedMemoryRing(shm, owner=True)
+
+    @staticmethod
+    def attach(name):
+        return SharedMemoryRing(_attach_shared_memory(name), owner=False)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def _read_head(self):
+        return _HEADER.unpack_from(self._shm.buf, 0)[1]
+
+    def write(self, array):
+        """
+            Copies the contiguous content of `array` into the ring and returns the absolute start offset.
+        """
+        assert self._owner
+        src = np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+        n_bytes = src.nbytes
+        if n_bytes > self.capacity:
+            raise ValueError("Array of {} bytes exceeds ring capacity of {} bytes".format(n_bytes, self.capacity))
+        offset = self._head % self.capacity
+        if offset + n_bytes > self.capacity:
+            # skip the tail, regions are never split
+            self._head += self.capacity - offset
+            offset = 0
+        start = self._head
+        self._head += -(-n_bytes // _ALIGNMENT) * _ALIGNMENT
+        _HEADER.pack_into(self._shm.buf, 0, self.capacity, self._head)
+        self._data[offset:offset + n_bytes] = src
+        return start
+
+    def read(self, start, n_bytes, dtype, shape):
+        """
+            Returns a view onto the region written at `start`. The view is only valid until the ring wraps around.
+        """
+        offset = start % self.capacity
+        return self._data[offset:offset + n_bytes].view(dtype).reshape(shape)
+
+    def is_valid(self, start):
+        return self._read_head() - start <= self.capacity
+
+    def close(self):
+        self._data = None
+        try:
+            self._shm.close()
+            if self._owner:
+                self._shm.unlink()
+        except BufferError:
+            logger.warning("Shared memory segment {} is still referenced and cannot be closed".format(self.name))
+
+
+class SharedMemoryPublisher(Publisher):
+    """
+        Publisher for peers on the same host, with the same `send_multipart` surface as `Publisher`.
+
+        NumPy arrays of at least `inline_threshold` bytes are copied into a shared memory ring buffer and never
+        serialized; only a small notification containing their location is sent via ZMQ (`ipc` by default).
+        Smaller arrays are sent inline as raw bytes, other frames are sent unchanged.
+        For the `ipc` transport, `host` is a path prefix, e.g. "ipc:///tmp/snn_utils:5555".
+    """
+
+    def __init__(self, port, capacity=64 * 1024 ** 2, shm_name=None, inline_threshold=4096, context=None,
+                 host="/tmp/snn_utils", transport='ipc', **kwargs):
+        Publisher.__init__(self, port, context=context, host=host, transport=transport, **kwargs)
+        self._ring = SharedMemoryRing.create(capacity, shm_name)
+        self._inline_threshold = inline_threshold
+        logger.info("Sharing arrays via shared memory segment {} ({} bytes)".format(self._ring.name, capacity))
+
+    def _send_multipart(self, frames, *args, **kwargs):
+        descriptors = []
+        inline = []
+        for frame in frames[1:]:
+            if isinstance(frame, np.ndarray):
+                if frame.nbytes >= self._inline_threshold:
+                    descriptors.append((self._ring.write(frame), frame.nbytes, frame.dtype.str, frame.shape))
+                else:
+                    descriptors.append((None, frame.nbytes, frame.dtype.str, frame.shape))
+                    inline.append(np.ascontiguousarray(frame).tobytes())
+            else:
+                descriptors.append(None)
+                inline.append(frame)
+        header = repr((self._ring.name, descriptors)).encode()
+        return Publisher._send_multipart(self, [frames[0], header] + inline, *args, **kwargs)
+
+    def close(self):
+        Publisher.close(self)
+        self._ring.close()
+
+
+class SharedMemorySubscriber(MultiSubscriber):
+    """
+        Counterpart of `SharedMemoryPublisher`. Callbacks receive `[topic, frame, ...]` as for multipart messages,
+        with NumPy arrays in place of shared arrays.
+
+        Unless `copy` is set, arrays are views into the shared ring buffer, which are valid until the publisher
+        wraps around; messages whose regions have already been overwritten are dropped with a warning.
+        `deserialize` is only applied to frames which were not sent as arrays.
+    """
+
+    def __init__(self, *args, **kwargs):
+        MultiSubscriber.__init__(self, *args, **kwargs)
+        self._rings = {}
+        self.overruns = 0
+
+    def _ring(self, name):
+        ring = self._rings.get(name)
+        if ring is None:
+            ring = self._rings[name] = SharedMemoryRing.attach(name)
+        return ring
+
+    def add_subscriber(self, host, port, callback, transport="ipc", prefix="", deserialize=None, copy=False,
+                       **kwargs):
+        def on_message(msg):
+            name, descriptors = ast.literal_eval(msg[1].decode())
+            ring = self._ring(name)
+            inline = iter(msg[2:])
+            frames = []
+            for descriptor in descriptors:
+                if descriptor is None:
+                    frame = next(inline)
+                    frames.append(deserialize(frame) if deserialize else frame)
+                    continue
+                start, n_bytes, dtype, shape = descriptor
+                if start is None:
+                    frames.append(np.frombuffer(next(inline), dtype=dtype).reshape(shape))
+                    continue
+                if not ring.is_valid(start):
+                    self.overruns += 1
+                    logger.warning("Shared memory ring {} overrun, dropping message '{}'".format(name, msg[0].decode()))
+                    return
+                array = ring.read(start, n_bytes, dtype, shape)
+                frames.append(array.copy() if copy else array)
+            if copy and not all(ring.is_valid(d[0]) for d in descriptors if d is not None and d[0] is not None):
+                # the ring was overwritten while copying
+                self.overruns += 1
+                logger.warning("Shared memory ring {} overrun, dropping message '{}'".format(name, msg[0].decode()))
+                return
+            return callback([msg[0].decode()] + frames)
+
+        MultiSubscriber.add_subscriber(self, host, port, on_message, transport=transport, prefix=prefix,
+                                       multipart=True, **kwargs)
+
+    def close(self):
+        MultiSubscriber.close(self)
+        for ring in self._rings.values():
+            ring.close()
+        self._rings.clear()
@@ -6,6 +6,8 @@ import logging
 import operator
 import time
 
+from snn_utils.comm.packing import group_by_index
+
 logger = logging.getLogger(__name__)
 
 
@@ -25,6 +27,9 @@ class DataSource(object):
     def get_weight_data(self, key, time_window=None):
         raise NotImplementedError()
 
+    def get_sparse_weight_data(self, key, time_window=None):
+        raise NotImplementedError()
+
     def get_min_time(self):
         raise NotImplementedError()
 
@@ -36,6 +41,7 @@ class SimpleDataSource(DataSource):
     def __init__(self):
         self._map = collections.defaultdict(list)
         self._weight_map = {}
+        self._sparse_weight_map = {}
 
     def extend_cont_data(self, key, data):
         self._map[key].extend(data)
@@ -50,6 +56,12 @@ class SimpleDataSource(DataSource):
             self._weight_map[key] = df.copy()
             # self._weight_map[key] = self._weight_map[key].append(df)
 
+    def extend_sparse_weight_data(self, key, matrix):
+        """
+            Stores the latest `snn_utils.sparse.SparseWeightMatrix` of the given key.
+        """
+        self._sparse_weight_map[key] = matrix
+
     def get_cont_data(self, keys, time_window=None):
         return [self._map[key] for key in keys]
 
@@ -63,6 +75,12 @@ class SimpleDataSource(DataSource):
         else:
             return df[(df.sim_time >= time_window[0]) & (df.sim_time < time_window[1])]
 
+    def get_sparse_weight_data(self, key, time_window=None):
+        matrix = self._sparse_weight_map.get(key)
+        if matrix is None or time_window is None or time_window[0] <= matrix.sim_time < time_window[1]:
+            return matrix
+        return None
+
     def reset(self):
         self._map.clear()
 
@@ -102,7 +120,16 @@ class ProxyDataSource(DataSource):
                 r[k] = v
         return r
 
-    def dump_delta(self, curr_time):
+    @staticmethod
+    def _copy_buffer(buffer):
+        return buffer.get_timed_values() if hasattr(buffer, 'get_timed_values') else list(buffer.get_times())
+
+    def dump_delta(self, curr_time, copy=False):
+        """
+            Returns the current content of the mapped buffers.
+            Unless `copy` is set, the result refers to the live buffers, which are modified by subsequent cycles;
+            set it if the delta is processed later or on another thread (e.g. in a side task of a `PyMusicNode`).
+        """
         assert self._sender
 
         # send only those buffers (with index) which actually contain data
@@ -110,14 +137,16 @@ class ProxyDataSource(DataSource):
         event_updates = ProxyDataSource._filter_dict_values(self._map['event'])
 
         result = [list(self._map['cont'].items())]
+        if copy:
+            event_updates = dict([(key, dict([(i, self._copy_buffer(buffer)) for i, buffer in buffers.items()]))
+                                  for key, buffers in event_updates.items()])
+            result = [[(key, self._copy_buffer(buffer)) for key, buffer in result[0]]]
 
         if event_updates:
             result.append(event_updates)
         return curr_time, result
 
-    def read_delta(self, delta):
-        curr_time, updates = delta
-
+    def _advance_time(self, curr_time):
         if self._min_time is None:
             self._min_time = curr_time
 
@@ -131,6 +160,10 @@ class ProxyDataSource(DataSource):
         self._max_time = curr_time
         assert self._min_time <= self._max_time, "{} should be <= {}".format(self._min_time, self._max_time)
 
+    def read_delta(self, delta):
+        curr_time, updates = delta
+        self._advance_time(curr_time)
+
         for key, buffer in updates[0]:
             self._map[key].extend(buffer)
         if len(updates) > 1:
@@ -138,6 +171,17 @@ class ProxyDataSource(DataSource):
                 for i, buffer in buffer_map.items():
                     self._map[(key, int(i))].extend(buffer)
 
+    def read_packed_events(self, key, curr_time, times, lids):
+        """
+            Reads a batch of spike events given as arrays of times and indices,
+            e.g. as sent by `snn_utils.comm.nest.SpikeCommunicator` (see `snn_utils.comm.packing.unpack_spikes`).
+        """
+        self._advance_time(curr_time)
+        if not len(times):
+            return
+        for lid, lid_times in group_by_index(lids, times):
+            self._map[(key, lid)].extend(lid_times.tolist())
+
     def get_cont_data(self, keys, time_window=None):
         assert not self._sender
         if time_window is None:
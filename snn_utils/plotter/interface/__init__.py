@@ -27,11 +27,11 @@ class Master(object):
     This class combines a communication sink with a simple periodic task scheduler.
     """
 
-    def __init__(self, poll_timeout=None):
+    def __init__(self, poll_timeout=None, **subscriber_params):
         if poll_timeout is None:
-            self._comm = MultiSubscriber()
+            self._comm = MultiSubscriber(**subscriber_params)
         else:
-            self._comm = MultiSubscriber(poll_timeout=poll_timeout)
+            self._comm = MultiSubscriber(poll_timeout=poll_timeout, **subscriber_params)
         self._scheduler = SimpleTaskScheduler()
 
     def communicator(self):
@@ -1,7 +1,11 @@
+import itertools
+
 import numpy as np
 
+import matplotlib
 import matplotlib.ticker as ticker
-from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.colors import LinearSegmentedColormap, to_rgba_array
+from matplotlib.lines import Line2D
 
 
 class EmptyPlot(object):
@@ -70,7 +74,13 @@ class Plot(object):
             loc = self._legend_loc
             if loc is None:
                 loc = 'upper right'
-            self._ax.legend(self._legend, prop={'size': 12}, loc=loc, ncol=len(self._legend))
+            handles = self._legend_handles()
+            args = [self._legend] if handles is None else [handles, self._legend]
+            self._ax.legend(*args, prop={'size': 12}, loc=loc, ncol=len(self._legend))
+
+    def _legend_handles(self):
+        # artists to label, or None for the artists of the axis
+        return None
 
     def _create_primitive(self, color):
         return None
@@ -94,6 +104,84 @@ class Plot(object):
 
 
 class TimeSeriesPlot(Plot):
+    """
+        Base class for plots over simulation time.
+
+        With `decimate`, lines with more samples than the axis has pixel columns are reduced to (up to) five samples
+        per column: the first, minimum, maximum and last sample and the first NaN, in order of time (M4),
+        which keeps extrema and gaps while bounding the rendering cost by the width of the axis.
+
+        Plots which update incrementally (see `_fetch_window`) re-fetch the last `late_data_margin` [s] before the
+        previous upper x-limit each update, which catches data delivered after it has been drawn
+        (e.g. events received with latency or samples timestamped before their delivery).
+    """
+
+    POINTS_PER_COLUMN = 5
+
+    def __init__(self, data_source, keys, label, legend, legend_loc, colors, decimate=True, late_data_margin=0.5):
+        Plot.__init__(self, data_source, keys, label, legend, legend_loc, colors)
+        self._decimate_lines = decimate
+        self._late_data_margin = late_data_margin
+        self._fetched_x_lim = None
+
+    def _fetch_window(self, fetch):
+        """
+            Fetches data of all keys for an incremental update via `fetch(keys, time_window)`,
+            e.g. `DataSource.get_event_data`. Returns `(lower, upper, since, data)`:
+            if `since` is None, `data` covers the x-limits `(lower, upper)` and replaces all previous data,
+            otherwise it covers `[since, upper)` and replaces the previous data from `since` on.
+        """
+        lower, upper = self._ax.get_xlim()
+        previous, self._fetched_x_lim = self._fetched_x_lim, (lower, upper)
+        since = None
+        if previous is not None and lower >= previous[0] and upper >= previous[1]:
+            since = previous[1] - self._late_data_margin
+            if since <= lower:
+                since = None
+        # data sources exclude the lower bound of the window
+        window_lower = lower if since is None else since - 1e-9
+        return lower, upper, since, fetch(self._keys, (window_lower, upper))
+
+    @staticmethod
+    def _window_mask(times, lower, upper, since):
+        # data sources are not required to apply the time window
+        mask = (times > lower) & (times < upper)
+        if since is not None:
+            mask &= times >= since
+        return mask
+
+    def _decimate(self, times, values):
+        # assumes times in ascending order
+        n_columns = max(int(self._ax.get_window_extent().width), 1)
+        if not self._decimate_lines or len(times) <= TimeSeriesPlot.POINTS_PER_COLUMN * n_columns:
+            return times, values
+        lower, upper = self._ax.get_xlim()
+        if upper <= lower:
+            return times, values
+        edges = lower + (upper - lower) * np.arange(1, n_columns) / n_columns
+        starts = np.concatenate(([0], np.searchsorted(times, edges)))
+        ends = np.concatenate((starts[1:], [len(times)]))
+        non_empty = starts < ends
+        starts, ends = starts[non_empty], ends[non_empty]
+
+        # index of the first occurrence of the minimum, maximum and NaN of each column (len(times) if none)
+        n = len(times)
+        indices = np.arange(n)
+        columns = np.repeat(np.arange(len(starts)), ends - starts)
+        is_nan = np.isnan(values)
+        with np.errstate(invalid='ignore'):
+            minima = np.fmin.reduceat(values, starts)
+            maxima = np.fmax.reduceat(values, starts)
+        candidates = [starts, ends - 1]
+        for mask in [values == minima[columns], values == maxima[columns], is_nan]:
+            candidates.append(np.minimum.reduceat(np.where(mask, indices, n), starts))
+        # emit the samples of each column in order of time, each once
+        selected = np.sort(np.column_stack(candidates), axis=1)
+        keep = selected < n
+        keep[:, 1:] &= selected[:, 1:] != selected[:, :-1]
+        selected = selected[keep]
+        return times[selected], values[selected]
+
     def build(self, ax, show_x=False, col_header=False, col_footer=False):
         self._ax = ax
         self._create_primitives()
@@ -141,9 +229,9 @@ class TimePlotDual(object):
 
 class PhasePlot(TimeSeriesPlot):
     def __init__(self, data_source, key, n_values, zero_is_value=False, y_pos=0, common_line_style=None,
-                 individual_line_styles=None, label=None, legend=None, legend_loc=None, colors=None):
+                 individual_line_styles=None, label=None, legend=None, legend_loc=None, colors=None, decimate=True):
         self._n_values = n_values
-        TimeSeriesPlot.__init__(self, data_source, [key], label, legend, legend_loc, colors)
+        TimeSeriesPlot.__init__(self, data_source, [key], label, legend, legend_loc, colors, decimate)
         assert legend is None or len(legend) == n_values
         assert len(self._colors) == n_values
         assert y_pos == 0 or np.abs(y_pos) >= 1
@@ -183,19 +271,93 @@ class PhasePlot(TimeSeriesPlot):
         times, values = np.rollaxis(signal, 1)
         for value_id, ps in enumerate(self._ps, start=self._drop_zero):
             transformed_values = values.copy()
-            transformed_values[np.where(values != value_id)] = np.NaN
+            transformed_values[np.where(values != value_id)] = np.nan
             transformed_values[np.where(values == value_id)] = 0
-            ps.set_data(np.array([times, transformed_values]))
+            ps.set_data(*self._decimate(times, transformed_values))
+
+
+def _merge_bounds(bounds, values):
+    # (min, max) of the given bounds (or None) and the non-NaN values
+    if not len(values) or np.isnan(values).all():
+        return bounds
+    lower, upper = np.nanmin(values), np.nanmax(values)
+    return (lower, upper) if bounds is None else (min(bounds[0], lower), max(bounds[1], upper))
+
+
+class _LineBuffer(object):
+    """
+        Time-ordered samples of a line in growing NumPy arrays; old samples are discarded from the front.
+    """
+
+    def __init__(self, capacity=1024):
+        self._times = np.empty(capacity)
+        self._values = np.empty(capacity)
+        self._start = 0
+        self._end = 0
+
+    def clear(self):
+        self._start = self._end = 0
+
+    def extend(self, times, values):
+        n = len(times)
+        if self._end + n > len(self._times):
+            size = self._end - self._start
+            capacity = max(len(self._times), 2 * (size + n))
+            for name in ['_times', '_values']:
+                array = getattr(self, name)
+                resized = np.empty(capacity) if capacity > len(array) else array
+                resized[:size] = array[self._start:self._end]
+                setattr(self, name, resized)
+            self._start, self._end = 0, size
+        self._times[self._end:self._end + n] = times
+        self._values[self._end:self._end + n] = values
+        self._end += n
+
+    def drop_until(self, lower):
+        """
+            Discards all samples up to (including) `lower` and returns their values.
+        """
+        start = self._start + np.searchsorted(self.times(), lower, side='right')
+        dropped = self._values[self._start:start]
+        self._start = start
+        return dropped
+
+    def drop_from(self, since):
+        """
+            Discards all samples from `since` on and returns their values.
+        """
+        end = self._start + np.searchsorted(self.times(), since, side='left')
+        dropped = self._values[end:self._end]
+        self._end = end
+        return dropped
+
+    def times(self):
+        return self._times[self._start:self._end]
+
+    def values(self):
+        return self._values[self._start:self._end]
 
 
 class AnalogSignalPlot(TimeSeriesPlot):
+    """
+        Line plot of continuous signals, autoscaled unless `y_lim` is given.
+
+        With `incremental`, each line keeps its samples in NumPy arrays which are only updated with the samples
+        since the previous update (minus `late_data_margin`, see `TimeSeriesPlot`) and truncated at the lower
+        x-limit. The y-limits are changed only if the running minimum or maximum of the visible samples change.
+    """
+
     def __init__(self, data_source, keys, label=None, legend=None, legend_loc=None, colors=None, y_lim=None,
                  y_ticks=None,
-                 y_ticks_right=True):
-        TimeSeriesPlot.__init__(self, data_source, keys, label, legend, legend_loc, colors)
+                 y_ticks_right=True, incremental=False, decimate=True, late_data_margin=0.5):
+        TimeSeriesPlot.__init__(self, data_source, keys, label, legend, legend_loc, colors, decimate,
+                                late_data_margin)
         self._y_lim = y_lim
         self._y_ticks = y_ticks
         self._y_ticks_right = y_ticks_right
+        self._incremental = incremental
+        self._lines = dict([(key, _LineBuffer()) for key in keys]) if incremental else None
+        self._value_bounds = None
 
     def _configure_axis(self):
         TimeSeriesPlot._configure_axis(self)
@@ -218,18 +380,65 @@ class AnalogSignalPlot(TimeSeriesPlot):
 
     def update(self):
         TimeSeriesPlot.update(self)
+        if self._incremental:
+            return self._update_incremental()
         for key, signal in zip(self._keys, self._get_data_source().get_cont_data(self._keys, self._ax.get_xlim())):
-            self._ps[key].set_data(np.rollaxis(np.array(signal), 1))
+            times, values = np.rollaxis(np.array(signal, dtype=float).reshape(-1, 2), 1)
+            self._ps[key].set_data(*self._decimate(times, values))
         if not self._y_lim:
             self._ax.relim()
             self._ax.autoscale_view(True, True, True)
 
+    def _update_incremental(self):
+        lower, upper, since, data = self._fetch_window(self._get_data_source().get_cont_data)
+        full = since is None
+        recompute_bounds = full
+        bounds = self._value_bounds if not full else None
+        for key, signal in zip(self._keys, data):
+            line = self._lines[key]
+            if full:
+                line.clear()
+            else:
+                for dropped in [line.drop_until(lower), line.drop_from(since)]:
+                    dropped_bounds = _merge_bounds(None, dropped)
+                    if bounds is not None and dropped_bounds is not None and \
+                            (dropped_bounds[0] <= bounds[0] or dropped_bounds[1] >= bounds[1]):
+                        recompute_bounds = True
+            samples = np.array(signal, dtype=float).reshape(-1, 2)
+            samples = samples[self._window_mask(samples[:, 0], lower, upper, since)]
+            if len(samples):
+                samples = samples[np.argsort(samples[:, 0], kind='stable')]
+                line.extend(samples[:, 0], samples[:, 1])
+                bounds = _merge_bounds(bounds, samples[:, 1])
+            self._ps[key].set_data(*self._decimate(line.times(), line.values()))
+
+        if recompute_bounds:
+            bounds = None
+            for line in self._lines.values():
+                bounds = _merge_bounds(bounds, line.values())
+        if bounds != self._value_bounds:
+            self._value_bounds = bounds
+            if not self._y_lim and bounds is not None:
+                self._rescale(*bounds)
+
+    def _rescale(self, lower, upper):
+        margin = (upper - lower) * self._ax.margins()[1] if upper > lower else 0.5
+        self._ax.set_ylim(lower - margin, upper + margin)
+
 
 class SpikeTrainPlot(TimeSeriesPlot):
+    """
+        Raster plot of the spike trains of the given keys (one row per key), drawn as a single scatter collection.
+        Each update only fetches spikes since the previous one (minus `late_data_margin`, see `TimeSeriesPlot`)
+        and discards those left of the x-limits; the raster is rebuilt if the x-limits move backwards
+        (e.g. after a reset).
+    """
+
     def __init__(self, data_source, keys, label=None, legend=None, legend_loc=None, colors=None,
                  y_tick_filter=lambda ids: [],
-                 y_tick_labels=lambda ids: list(map(str, ids)), y_ticks_right=True):
-        Plot.__init__(self, data_source, keys, label, legend, legend_loc, colors)
+                 y_tick_labels=lambda ids: list(map(str, ids)), y_ticks_right=True, late_data_margin=0.5):
+        TimeSeriesPlot.__init__(self, data_source, keys, label, legend, legend_loc, colors,
+                                late_data_margin=late_data_margin)
         self._y_tick_filter = y_tick_filter
         self._y_tick_labels = y_tick_labels
         self._y_ticks_right = y_ticks_right
@@ -247,15 +456,47 @@ class SpikeTrainPlot(TimeSeriesPlot):
         else:
             self._ax.yaxis.set_ticks([])
 
-    def _create_primitive(self, color):
-        return self._ax.scatter([], [], color=color, marker='|', linewidth='1.5', s=20)
+    def _create_primitives(self):
+        colors = self._colors
+        if all(color is None for color in colors):
+            # as separate scatter plots would have been colored
+            cycle = matplotlib.rcParams['axes.prop_cycle'].by_key()['color']
+            colors = [cycle[i % len(cycle)] for i in range(len(self._keys))]
+        self._row_colors = to_rgba_array(colors)
+        self._uniform_color = bool((self._row_colors == self._row_colors[0]).all())
+        self._ps = self._ax.scatter([], [], color=self._row_colors[0], marker='|', linewidth=1.5, s=20)
+        self._times = np.empty(0)
+        self._rows = np.empty(0, dtype=int)
+
+    def _legend_handles(self):
+        # the rows share a single collection
+        return [Line2D([], [], color=color, marker='|', markersize=np.sqrt(20), markeredgewidth=1.5, linestyle='None')
+                for color in self._row_colors[:len(self._legend)]]
+
+    def get_artists(self):
+        return [self._ps]
 
     def update(self):
         TimeSeriesPlot.update(self)
-        for key, times in zip(self._keys, self._get_data_source().get_event_data(self._keys, self._ax.get_xlim())):
-            # FIXME inefficient
-            offsets = np.rollaxis(np.array([times, np.ones_like(times, dtype=int) * self._keys.index(key)]), 1)
-            self._ps[key].set_offsets(offsets)
+        lower, upper, since, data = self._fetch_window(self._get_data_source().get_event_data)
+        counts = [len(times) for times in data]
+        times = np.fromiter(itertools.chain.from_iterable(data), dtype=float, count=sum(counts))
+        rows = np.repeat(np.arange(len(self._keys)), counts)
+        mask = self._window_mask(times, lower, upper, since)
+        times, rows = times[mask], rows[mask]
+        order = np.argsort(times, kind='stable')
+        times, rows = times[order], rows[order]
+        if since is None:
+            self._times, self._rows = times, rows
+        else:
+            # keep the spikes within the x-limits which have not been fetched again
+            start = np.searchsorted(self._times, lower, side='right')
+            end = np.searchsorted(self._times, since, side='left')
+            self._times = np.concatenate((self._times[start:end], times))
+            self._rows = np.concatenate((self._rows[start:end], rows))
+        self._ps.set_offsets(np.column_stack((self._times, self._rows)))
+        if not self._uniform_color:
+            self._ps.set_color(self._row_colors[self._rows])
 
 
 class SpikeMapPlot(Plot):
@@ -309,10 +550,17 @@ class SpikeMapPlot(Plot):
 
 
 class WeightPlot(Plot):
-    def __init__(self, data_source, key, show_ticks=False, label=None, legend=None, legend_loc=None, colors=None):
+    """
+        Base class for plots of the latest weight snapshot of a connection set.
+        Snapshots are pandas DataFrames, or `snn_utils.sparse.SparseWeightMatrix` objects if `sparse` is set.
+    """
+
+    def __init__(self, data_source, key, show_ticks=False, label=None, legend=None, legend_loc=None, colors=None,
+                 sparse=False):
         Plot.__init__(self, data_source, [key], label, legend, legend_loc, colors)
         self._last_plot_ts = None
         self._show_ticks = show_ticks
+        self._sparse = sparse
 
     def update(self):
         Plot.update(self)
@@ -320,13 +568,19 @@ class WeightPlot(Plot):
         time_window = None
         if self._last_plot_ts is not None:
             time_window = (self._last_plot_ts + 0.00001, np.inf)
+        if self._sparse:
+            matrix = self._get_data_source().get_sparse_weight_data(self._keys[0], time_window)
+            if matrix is not None:
+                self._last_plot_ts = matrix.sim_time
+                self._update_plot(matrix)
+            return
         df = self._get_data_source().get_weight_data(self._keys[0], time_window)
         if not df.sim_time.empty:
             if self._last_plot_ts is None or max(df.sim_time) > self._last_plot_ts:
                 self._last_plot_ts = max(df.sim_time)
                 self._update_plot(df[df.sim_time == self._last_plot_ts])
 
-    def _update_plot(self, df):
+    def _update_plot(self, weights):
         pass
 
     def build(self, ax, *args, **kwargs):
@@ -336,8 +590,10 @@ class WeightPlot(Plot):
 
 
 class QuiverWeightPlot(WeightPlot):
-    def __init__(self, data_source, key, weight_to_spatial, label=None, legend=None, legend_loc=None, colors=None):
-        WeightPlot.__init__(self, data_source, key, label, legend, legend_loc, colors)
+    def __init__(self, data_source, key, weight_to_spatial, label=None, legend=None, legend_loc=None, colors=None,
+                 sparse=False):
+        WeightPlot.__init__(self, data_source, key, label=label, legend=legend, legend_loc=legend_loc, colors=colors,
+                            sparse=sparse)
         self._weight_to_spatial = weight_to_spatial
         self._updated = True
 
@@ -386,3 +642,51 @@ class QuiverWeightPlot(WeightPlot):
         if self._updated:
             WeightPlot.draw(self)
             self._updated = False
+
+
+class WeightMatrixPlot(WeightPlot):
+    """
+        Heatmap of the latest sparse weight matrix (pre-synaptic neurons as rows, post-synaptic neurons as columns).
+        Unconnected pairs are left blank.
+    """
+
+    def __init__(self, data_source, key, value_bounds=None, transpose=False, cmap=None, show_ticks=False,
+                 label=None, legend=None, legend_loc=None, colors=None):
+        WeightPlot.__init__(self, data_source, key, show_ticks=show_ticks, label=label, legend=legend,
+                            legend_loc=legend_loc, colors=colors, sparse=True)
+        self._value_bounds = value_bounds
+        self._transpose = transpose
+        self._cmap = cmap
+        self._dense = None
+
+    def _create_primitives(self):
+        self._ps = None
+
+    def _configure_axis(self):
+        WeightPlot._configure_axis(self)
+        self._ax.xaxis.tick_top()
+        self._ax.xaxis.set_visible(self._show_ticks)
+        self._ax.yaxis.set_visible(self._show_ticks)
+
+    def _update_plot(self, matrix):
+        if self._dense is None or self._dense.shape != matrix.shape:
+            self._dense = np.empty(matrix.shape, dtype=np.float32)
+            self._ps = None
+        matrix.to_dense(out=self._dense)
+        image = self._dense.T if self._transpose else self._dense
+        if self._ps is None:
+            self._ax.clear()
+            self._configure_axis()
+            vmin, vmax = self._value_bounds if self._value_bounds is not None else (None, None)
+            self._ps = self._ax.imshow(image, vmin=vmin, vmax=vmax, cmap=self._cmap, aspect='auto',
+                                       interpolation='nearest')
+        else:
+            self._ps.set_data(image)
+            if self._value_bounds is None and len(matrix):
+                self._ps.set_clim(np.min(matrix.data), np.max(matrix.data))
+
+    def get_artists(self):
+        if self._ps is not None:
+            return [self._ps]
+        else:
+            return []
@@ -0,0 +1,72 @@
+import numpy as np
+
+
+class SparseWeightMatrix(object):
+    """
+        Weights of a projection in coordinate (COO) format, indexed by local ids,
+        i.e. `row` holds pre-synaptic and `col` post-synaptic ids relative to their population.
+        If there are multiple synapses per pair of neurons, dense conversions keep the last one.
+    """
+
+    def __init__(self, row, col, data, shape=None, sim_time=None):
+        self.row = np.asarray(row, dtype=np.int32)
+        self.col = np.asarray(col, dtype=np.int32)
+        self.data = np.asarray(data)
+        assert len(self.row) == len(self.col) == len(self.data)
+        if shape is None:
+            shape = (int(self.row.max()) + 1 if len(self.row) else 0, int(self.col.max()) + 1 if len(self.col) else 0)
+        self.shape = tuple(shape)
+        self.sim_time = sim_time
+        self._flat_index = None
+        self._csr = None
+
+    @staticmethod
+    def from_message(msg):
+        """
+            Creates a matrix from a `WeightCommunicator` message (or a decoded weight stream message).
+        """
+        return SparseWeightMatrix(msg['src_lid'], msg['trg_lid'], msg['weight'], msg.get('shape'), msg['sim_time'])
+
+    def with_data(self, data, sim_time=None):
+        """
+            Returns a matrix with the same topology and new weights; index structures are shared.
+        """
+        matrix = SparseWeightMatrix(self.row, self.col, data, self.shape, sim_time)
+        matrix._flat_index = self._flat_index
+        matrix._csr = self._csr
+        return matrix
+
+    def __len__(self):
+        return len(self.data)
+
+    def _get_flat_index(self):
+        if self._flat_index is None:
+            self._flat_index = np.ravel_multi_index((self.row, self.col), self.shape)
+        return self._flat_index
+
+    def to_dense(self, fill_value=np.nan, out=None):
+        if out is None:
+            out = np.empty(self.shape, dtype=np.result_type(self.data, np.float32))
+        assert out.shape == self.shape
+        out.fill(fill_value)
+        np.put(out, self._get_flat_index(), self.data)
+        return out
+
+    def csr_structure(self):
+        """
+            Returns `(order, indptr, indices)` such that `self.data[order]` are the values in CSR order.
+        """
+        if self._csr is None:
+            order = np.lexsort((self.col, self.row))
+            indptr = np.zeros(self.shape[0] + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.row, minlength=self.shape[0]), out=indptr[1:])
+            self._csr = order, indptr, self.col[order]
+        return self._csr
+
+    def row_slice(self, row):
+        """
+            Returns `(cols, values)` of all synapses of pre-synaptic neuron `row`.
+        """
+        order, indptr, indices = self.csr_structure()
+        selection = order[indptr[row]:indptr[row + 1]]
+        return indices[indptr[row]:indptr[row + 1]], self.data[selection]